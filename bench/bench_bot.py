@@ -0,0 +1,543 @@
+# Offline benchmark for the whole bot pipeline.
+#
+# A local HTTP server stands in for every external service:
+#   /feeds/<name>.xml                 recorded RSS snapshots from bench/feeds, released over time
+#   /img/...                          article images referenced by those feeds
+#   /article/...                      article pages linked from those feeds (og:image in <head>)
+#   /rss/articles/<id>, /_/DotsSplashUi/data/batchexecute
+#                                     Google News article id -> publisher URL lookup
+#   /bot<token>/<method>              Telegram Bot API
+#   /openai/v1/chat/completions       Groq chat completions
+#   /client/v4/accounts/.../ai/run/.. Cloudflare Workers AI (SDXL)
+#
+# bot.py is imported with its endpoints pointed at that server and driven directly:
+# send_recent_news(initial_run=True), then run_check_cycle() N times, then the
+# rolling summary refresh and send_and_pin_summary('manual'). Reports per-cycle latency, items/sec and peak memory.
+#
+#   python bench/bench_bot.py --cycles 10 --feed-latency 0.2 --cloudflare-latency 1.5
+#   python bench/bench_bot.py --replay --hours 24
+#   CHANNELS_FILE=$PWD/channels.json python bench/bench_bot.py   (absolute path: the run chdirs)
+#
+# --replay runs on a virtual clock: bot's time/datetime are swapped for a clock the
+# harness advances, feeds are polled when their adaptive interval says they are due
+# (or all together every 120-300s with --fixed-interval), and summary slots fire as
+# the clock crosses them, so a day of traffic takes seconds.
+
+import argparse
+import datetime
+import email.utils
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from concurrent.futures import wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FEEDS_DIR = os.path.join(ROOT, 'bench', 'feeds')
+sys.path.insert(0, ROOT)
+
+ITEM_RE = re.compile(r'<item>.*?</item>\s*', re.DOTALL)
+PUBDATE_RE = re.compile(r'<pubDate>(.*?)</pubDate>')
+IMAGE_HOST_RE = re.compile(r'https://(assets\.bwbx\.io|i-invdn-com\.investing\.com|images\.mktw\.net)/')
+ARTICLE_HOST_RE = re.compile(r'https://(www\.bloomberg\.com|www\.investing\.com|www\.marketwatch\.com)/')
+
+
+# ────────────────────────────────────────────────
+#                CLOCKS
+# ────────────────────────────────────────────────
+
+class RealClock:
+    # Wall clock for the bot; the feed timeline runs ahead by `skew`
+    # so each cycle sees the items "published" since the previous one
+    def __init__(self):
+        self.skew = 0.0
+
+    def time(self):
+        return time.time()
+
+    def timeline(self):
+        return time.time() + self.skew
+
+    def advance(self, seconds):
+        self.skew += seconds
+
+
+class VirtualClock:
+    def __init__(self, start):
+        self.now = start
+        self.lock = threading.Lock()
+
+    def time(self):
+        with self.lock:
+            return self.now
+
+    timeline = time
+
+    def advance(self, seconds):
+        with self.lock:
+            self.now += seconds
+
+
+def install_virtual_clock(bot, clock):
+    # bot.py only reads time through its module-level `time` and `datetime` names
+    vtime = types.ModuleType('time')
+    vtime.__dict__.update(time.__dict__)
+    vtime.time = clock.time
+    vtime.monotonic = clock.time
+    vtime.sleep = lambda seconds: None
+
+    class VirtualDateTime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.datetime.fromtimestamp(clock.time(), tz)
+
+    class VirtualDate(datetime.date):
+        @classmethod
+        def today(cls):
+            return datetime.datetime.fromtimestamp(clock.time()).date()
+
+    vdatetime = types.ModuleType('datetime')
+    vdatetime.__dict__.update(datetime.__dict__)
+    vdatetime.datetime = VirtualDateTime
+    vdatetime.date = VirtualDate
+
+    bot.time = vtime
+    bot.datetime = vdatetime
+
+
+# ────────────────────────────────────────────────
+#                RECORDED FEEDS
+# ────────────────────────────────────────────────
+
+class RecordedFeed:
+    # Half of the recorded items are already out when the run starts, the rest
+    # are released evenly over `duration` seconds of timeline
+    def __init__(self, path, start, duration):
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        items = ITEM_RE.findall(text)
+        first = ITEM_RE.search(text)
+        self.head = text[:first.start()] if first else text
+        self.tail = text[text.rfind('</item>') + len('</item>'):].lstrip() if items else ''
+
+        items.reverse()  # recorded newest first -> oldest first
+        already_out = len(items) // 2
+        upcoming = len(items) - already_out
+        self.items = []
+        for i, item in enumerate(items):
+            if i < already_out:
+                release = start - (already_out - i) * 1200
+            else:
+                release = start + (i - already_out + 1) * duration / (upcoming + 1)
+            self.items.append((release, item))
+
+    def render(self, clock, base_url):
+        timeline_now = clock.timeline()
+        wall_now = clock.time()
+        visible = []
+        for release, item in self.items:
+            if release > timeline_now:
+                continue
+            published = email.utils.formatdate(wall_now - (timeline_now - release), usegmt=True)
+            visible.append(PUBDATE_RE.sub(f'<pubDate>{published}</pubDate>', item))
+        visible.reverse()
+        body = self.head + ''.join(visible) + self.tail
+        body = IMAGE_HOST_RE.sub(lambda m: f"{base_url}/img/{m.group(1)}/", body)
+        return ARTICLE_HOST_RE.sub(lambda m: f"{base_url}/article/{m.group(1)}/", body).encode('utf-8')
+
+
+# ────────────────────────────────────────────────
+#                STAND-IN SERVER
+# ────────────────────────────────────────────────
+
+class StandIn:
+    def __init__(self, feeds, clock, latency):
+        self.feeds = feeds
+        self.clock = clock
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.upload_bytes = 0
+        self.message_id = 1000
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.make_handler())
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def next_message_id(self):
+        with self.lock:
+            self.message_id += 1
+            return self.message_id
+
+    def article(self, path):
+        # About a third of the pages have no og:image; the body is padded so
+        # reading past </head> would show up as wasted bytes
+        digest = hashlib.sha256(path.encode()).hexdigest()
+        meta = ''
+        if int(digest[:2], 16) % 3:
+            meta = f'<meta property="og:image" content="/img/article/{digest[:16]}.jpg">'
+        return (f'<!DOCTYPE html><html><head><title>{digest[:8]}</title>{meta}</head>'
+                f'<body>{"<p>article text</p>" * 8000}</body></html>').encode('utf-8')
+
+    def telegram(self, method, body, content_type):
+        self.count(f"telegram.{method}")
+        if 'multipart/form-data' in content_type:
+            with self.lock:
+                self.upload_bytes += len(body)
+            params = {}
+        else:
+            params = {k: v[0] for k, v in parse_qs(body.decode('utf-8', 'ignore')).items()}
+
+        def message(**extra):
+            msg = {
+                'message_id': self.next_message_id(),
+                'date': int(self.clock.time()),
+                'chat': {'id': int(params.get('chat_id', -100)), 'type': 'channel'},
+            }
+            msg.update(extra)
+            return msg
+
+        if method == 'sendPhoto':
+            n = self.message_id + 1
+            result = message(photo=[
+                {'file_id': f"S{n}", 'file_unique_id': f"s{n}", 'width': 320, 'height': 180},
+                {'file_id': f"F{n}", 'file_unique_id': f"f{n}", 'width': 1280, 'height': 720},
+            ])
+        elif method == 'sendMediaGroup':
+            count = max(1, body.count(b'"type": "photo"') + body.count(b'"type":"photo"') + body.count(b'%22type%22%3A+%22photo%22'))
+            result = [message(photo=[{'file_id': f"G{self.message_id}", 'file_unique_id': 'g', 'width': 1280, 'height': 720}])
+                      for _ in range(count)]
+        elif method == 'getUpdates':
+            time.sleep(1)  # a long poll that never has updates
+            result = []
+        elif method in ('sendMessage', 'getMe'):
+            result = message(text=params.get('text', ''))
+            if method == 'getMe':
+                result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        else:
+            result = True
+        return 200, 'application/json', json.dumps({'ok': True, 'result': result}).encode()
+
+    def groq(self, body):
+        self.count('groq.chat')
+        request = json.loads(body or b'{}')
+        reply = {
+            'id': 'chatcmpl-bench',
+            'object': 'chat.completion',
+            'created': int(self.clock.time()),
+            'model': request.get('model', 'bench'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': "- Markets moved on the day's headlines.\n- Tech names led the session."},
+                'finish_reason': 'stop',
+                'logprobs': None,
+            }],
+            'usage': {'prompt_tokens': 200, 'completion_tokens': 30, 'total_tokens': 230},
+        }
+        return 200, 'application/json', json.dumps(reply).encode()
+
+    def make_handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, content_type, body, headers=()):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path.startswith('/feeds/'):
+                    time.sleep(standin.latency['feed'])
+                    feed = standin.feeds.get(path[len('/feeds/'):])
+                    if feed is None:
+                        return self.reply(404, 'text/plain', b'not found')
+                    standin.count('feed')
+                    body = feed.render(standin.clock, standin.base_url)
+                    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                    if self.headers.get('If-None-Match') == etag:
+                        standin.count('feed.304')
+                        self.send_response(304)
+                        self.send_header('ETag', etag)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    return self.reply(200, 'application/rss+xml', body, [('ETag', etag)])
+                if path.startswith('/img/'):
+                    time.sleep(standin.latency['image'])
+                    standin.count('image')
+                    body = b'\xff\xd8\xff\xe0' + hashlib.sha256(path.encode()).digest() * 512
+                    return self.reply(200, 'image/jpeg', body)
+                if path.startswith('/rss/articles/'):
+                    standin.count('google.article')
+                    digest = hashlib.sha256(path.encode()).hexdigest()
+                    body = (f'<c-wiz><div jscontroller="x" data-n-a-sg="{digest[:24]}" '
+                            f'data-n-a-ts="1700000000"></div></c-wiz>').encode('utf-8')
+                    return self.reply(200, 'text/html; charset=utf-8', body)
+                if path.startswith('/article/'):
+                    time.sleep(standin.latency['article'])
+                    standin.count('article')
+                    return self.reply(200, 'text/html; charset=utf-8', standin.article(path))
+                if path.startswith('/bot'):
+                    method = path.rsplit('/', 1)[-1]
+                    return self.reply(*standin.telegram(method, urlparse(self.path).query.encode(), ''))
+                return self.reply(404, 'text/plain', b'not found')
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if path.startswith('/bot'):
+                    time.sleep(standin.latency['telegram'])
+                    method = path.rsplit('/', 1)[-1]
+                    return self.reply(*standin.telegram(method, body, self.headers.get('Content-Type', '')))
+                if path == '/openai/v1/chat/completions':
+                    time.sleep(standin.latency['groq'])
+                    return self.reply(*standin.groq(body))
+                if path == '/_/DotsSplashUi/data/batchexecute':
+                    standin.count('google.batchexecute')
+                    request = json.loads(json.loads(parse_qs(body.decode('utf-8'))['f.req'][0])[0][0][1])
+                    target = f"{standin.base_url}/article/news.google/{request[2]}"
+                    envelope = ["wrb.fr", "Fbv4je", json.dumps(["garturlres", target, 1]), None, None, None, "generic"]
+                    return self.reply(200, 'application/json', (")]}'\n\n" + json.dumps([envelope])).encode('utf-8'))
+                if '/ai/run/' in path:
+                    time.sleep(standin.latency['cloudflare'])
+                    standin.count('cloudflare')
+                    return self.reply(200, 'image/png', b'\x89PNG\r\n\x1a\n' + hashlib.sha256(body).digest() * 1024)
+                return self.reply(404, 'text/plain', b'not found')
+
+
+        return Handler
+
+
+# ────────────────────────────────────────────────
+#                DRIVER
+# ────────────────────────────────────────────────
+
+def import_bot(standin):
+    os.environ.update({
+        'BOT_TOKEN': '123456:BENCH',
+        'GROQ_API_KEY': 'bench',
+        'CLOUDFLARE_API_TOKEN': 'bench',
+        'CLOUDFLARE_ACCOUNT_ID': 'bench',
+        'GROQ_BASE_URL': standin.base_url,
+        'CLOUDFLARE_API_BASE': standin.base_url + '/client/v4',
+        'GOOGLE_NEWS_BASE': standin.base_url,
+    })
+    import telebot.apihelper
+    telebot.apihelper.API_URL = standin.base_url + '/bot{0}/{1}'
+    import bot
+    return bot
+
+
+def prepare_bot(bot, standin, real_pacing):
+    bot.RSS_FEEDS = [(name, f"{standin.base_url}/feeds/{name}") for name in sorted(standin.feeds)]
+    if not real_pacing:
+        bot.TELEGRAM_CHAT_RATE = bot.TELEGRAM_CHAT_BURST = 1e9
+        bot.TELEGRAM_GLOBAL_RATE = 1e9
+    bot.load_state()
+    bot.load_sent_news()
+    bot.load_daily_news()
+    bot.load_backlog()
+    submit_when_done = bot.submit_when_done
+
+    def tracked_submit(*args, **kwargs):
+        job = submit_when_done(*args, **kwargs)
+        pending_jobs.append(job)
+        return job
+
+    bot.submit_when_done = tracked_submit
+    bot.telegram_thread.start()
+
+
+pending_jobs = []  # futures of posts still waiting for their images, see drain()
+
+
+def drain(bot):
+    # Posts reach the dispatcher only once their images are ready, so wait for
+    # those first; then jobs run in order, so an empty job queued last completes
+    # once everything queued before it has been sent
+    while pending_jobs:
+        wait([pending_jobs.pop()])
+    bot.submit_telegram_job(lambda: None).result()
+
+
+def posts_sent(standin):
+    return standin.calls.get('telegram.sendPhoto', 0) + standin.calls.get('telegram.sendMediaGroup', 0) \
+        + standin.calls.get('telegram.sendMessage', 0)
+
+
+def timed(label, fn, bot, standin, results):
+    before = posts_sent(standin)
+    start = time.perf_counter()
+    fn()
+    drain(bot)
+    elapsed = time.perf_counter() - start
+    results.append((label, elapsed, posts_sent(standin) - before))
+    return elapsed
+
+
+def report(results, standin, wall, peak, extra=(), max_rows=12):
+    print(f"{'stage':<18}{'latency s':>11}{'messages':>10}")
+    for label, elapsed, sent in results[:max_rows]:
+        print(f"{label:<18}{elapsed:>11.3f}{sent:>10}")
+    if len(results) > max_rows:
+        print(f"... {len(results) - max_rows} more")
+    cycles = [r for r in results if r[0].startswith('cycle')]
+    if cycles:
+        latencies = sorted(r[1] for r in cycles)
+        print(f"\ncycle latency: mean {sum(latencies) / len(latencies):.3f}s  "
+              f"p50 {latencies[len(latencies) // 2]:.3f}s  max {latencies[-1]:.3f}s")
+    total_sent = sum(r[2] for r in results)
+    print(f"messages sent: {total_sent}  ({total_sent / wall:.2f}/s over {wall:.2f}s wall)")
+    print(f"upload bytes:  {standin.upload_bytes}")
+    print(f"peak memory:   {peak / 1024 / 1024:.1f} MiB (tracemalloc)")
+    for line in extra:
+        print(line)
+    print("calls:         " + ', '.join(f"{k}={v}" for k, v in sorted(standin.calls.items())))
+
+
+def refresh_summaries(bot):
+    # What summary_builder does once news has landed
+    for channel in bot.CHANNELS:
+        bot.refresh_rolling_summary(channel['name'])
+
+
+def run_cycles(bot, standin, clock, args):
+    results = []
+    start = time.perf_counter()
+    timed('initial', lambda: bot.send_recent_news(initial_run=True), bot, standin, results)
+    for i in range(args.cycles):
+        clock.advance(args.cycle_minutes * 60)
+        timed(f"cycle {i + 1}", bot.run_check_cycle, bot, standin, results)
+    timed('rolling summary', lambda: refresh_summaries(bot), bot, standin, results)
+    timed('summary', lambda: bot.send_and_pin_summary('manual'), bot, standin, results)
+    return results, time.perf_counter() - start, ()
+
+
+def run_replay(bot, standin, clock, args):
+    import pytz
+    tz = pytz.timezone(bot.SUMMARY_TIMEZONE)
+    slots = bot.channel_summary_slots()
+    rng = random.Random(args.seed)
+    end = clock.time() + args.hours * 3600
+
+    results = []
+    summaries = 0
+    start = time.perf_counter()
+    timed('initial', lambda: bot.send_recent_news(initial_run=True), bot, standin, results)
+    n = 0
+    while True:
+        if args.fixed_interval:
+            step = rng.randint(120, 300)  # the old all-feeds-together spacing
+        else:
+            step = max(bot.next_feed_due() - clock.time(), 1)  # same wait as background_checker
+        if clock.time() + step > end:
+            break
+        before = datetime.datetime.fromtimestamp(clock.time(), tz)
+        clock.advance(step)
+        after = datetime.datetime.fromtimestamp(clock.time(), tz)
+        feeds = None if args.fixed_interval else bot.due_feeds(clock.time())
+        if feeds == []:
+            continue
+        n += 1
+        timed(f"cycle {n}", lambda: bot.run_check_cycle(feeds), bot, standin, results)
+        if bot.summary_dirty.is_set():
+            bot.summary_dirty.clear()
+            refresh_summaries(bot)
+        for channel, name, hour, minute in slots:
+            fire_at = bot.next_fire_time(tz, before, hour, minute)
+            if fire_at <= after:
+                timed(f"summary {name} {channel}", lambda: bot.run_summary_slot(channel, name, fire_at.date()),
+                      bot, standin, results)
+                summaries += 1
+    wall = time.perf_counter() - start
+    extra = (f"virtual time:  {args.hours}h in {wall:.2f}s ({args.hours * 3600 / wall:.0f}x), "
+             f"{n} cycles, {summaries} summaries",)
+    return results, wall, extra
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cycles', type=int, default=10, help='background cycles to run (default 10)')
+    parser.add_argument('--cycle-minutes', type=float, default=4, help='feed timeline advance per cycle')
+    parser.add_argument('--replay', action='store_true', help='run a virtual-clock replay instead of real cycles')
+    parser.add_argument('--hours', type=float, default=24, help='replay length in virtual hours')
+    parser.add_argument('--feed-latency', type=float, default=0.0)
+    parser.add_argument('--image-latency', type=float, default=0.0)
+    parser.add_argument('--article-latency', type=float, default=0.0)
+    parser.add_argument('--telegram-latency', type=float, default=0.0)
+    parser.add_argument('--groq-latency', type=float, default=0.0)
+    parser.add_argument('--cloudflare-latency', type=float, default=0.0)
+    parser.add_argument('--real-pacing', action='store_true', help="keep the bot's Telegram rate limits")
+    parser.add_argument('--fixed-interval', action='store_true',
+                        help='replay: poll every feed each 120-300s instead of per-feed adaptive intervals')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='bench_bot_'))  # state files and bot_log.txt go here
+
+    start = time.time()
+    if args.replay:
+        clock = VirtualClock(start)
+        duration = args.hours * 3600
+    else:
+        clock = RealClock()
+        duration = args.cycles * args.cycle_minutes * 60
+
+    feeds = {
+        os.path.basename(path): RecordedFeed(path, start, duration)
+        for path in sorted(glob.glob(os.path.join(FEEDS_DIR, '*.xml')))
+    }
+    latency = {
+        'feed': args.feed_latency,
+        'image': args.image_latency,
+        'article': args.article_latency,
+        'telegram': args.telegram_latency,
+        'groq': args.groq_latency,
+        'cloudflare': args.cloudflare_latency,
+    }
+    standin = StandIn(feeds, clock, latency)
+    standin.start()
+
+    bot = import_bot(standin)
+    if args.replay:
+        install_virtual_clock(bot, clock)
+    prepare_bot(bot, standin, args.real_pacing)
+
+    tracemalloc.start()
+    run = run_replay if args.replay else run_cycles
+    results, wall, extra = run(bot, standin, clock, args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"workdir: {os.getcwd()}\n")
+    report(results, standin, wall, peak, extra)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# Micro-benchmark: HTML description cleaning + image extraction.
+#
+# Compares the old per-entry path (BeautifulSoup tree for the text, then an
+# uncompiled <img regex over content/description/summary) with bot.extract_html,
+# over every entry in the recorded feeds in bench/feeds.
+#
+#   python bench/bench_html.py [--repeat 20]
+
+import argparse
+import glob
+import os
+import re
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FEEDS_DIR = os.path.join(ROOT, 'bench', 'feeds')
+sys.path.insert(0, ROOT)
+
+for name in ('BOT_TOKEN', 'GROQ_API_KEY', 'CLOUDFLARE_API_TOKEN', 'CLOUDFLARE_ACCOUNT_ID'):
+    os.environ.setdefault(name, '0:bench')
+os.chdir(tempfile.mkdtemp(prefix='bench_html_'))  # keep bot_log.txt out of the repo
+
+import feedparser  # noqa: E402
+from bs4 import BeautifulSoup  # noqa: E402
+
+import bot  # noqa: E402
+
+
+def legacy_clean_html(text):
+    if not text:
+        return ''
+    soup = BeautifulSoup(text, 'html.parser')
+    cleaned = soup.get_text(separator=' ', strip=True)
+    return re.sub(r'\s+', ' ', cleaned).strip()
+
+
+def legacy_image(entry):
+    for field in ('content', 'description', 'summary'):
+        value = entry.get(field)
+        if not value:
+            continue
+        texts = [item.get('value', '') for item in value] if isinstance(value, list) else [value]
+        for text in texts:
+            m = re.search(r'<img[^>]+src=["\'](.*?)["\']', text, re.IGNORECASE)
+            if m:
+                return m.group(1)
+    return None
+
+
+def legacy_path(entry, desc):
+    return legacy_clean_html(desc), legacy_image(entry)
+
+
+def fast_path(entry, desc):
+    # __wrapped__ bypasses the lru_cache so every call pays for a real scan
+    text, image = bot.extract_html.__wrapped__(desc)
+    if image is None:
+        for field in ('content', 'summary'):
+            value = entry.get(field)
+            if isinstance(value, list):
+                value = value[0].get('value', '') if value else ''
+            if value and value != desc:
+                image = bot.extract_html.__wrapped__(value)[1]
+                if image:
+                    break
+    return text, image
+
+
+def load_entries():
+    entries = []
+    for path in sorted(glob.glob(os.path.join(FEEDS_DIR, '*.xml'))):
+        with open(path, encoding='utf-8') as f:
+            feed = feedparser.parse(f.read())
+        for entry in feed.entries:
+            entries.append((entry, entry.get('description') or entry.get('summary') or ''))
+    return entries
+
+
+def run(fn, entries, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for entry, desc in entries:
+            fn(entry, desc)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    entries = load_entries()
+    if not entries:
+        sys.exit(f"No feeds found in {FEEDS_DIR}")
+
+    text_diff = image_diff = 0
+    for entry, desc in entries:
+        old_text, old_image = legacy_path(entry, desc)
+        new_text, new_image = fast_path(entry, desc)
+        text_diff += old_text != new_text
+        # The old regex returned src attributes still HTML-escaped (&amp;)
+        image_diff += (old_image and bot.html.unescape(old_image)) != new_image
+
+    legacy = run(legacy_path, entries, args.repeat)
+    fast = run(fast_path, entries, args.repeat)
+
+    print(f"entries:          {len(entries)}")
+    print(f"text mismatches:  {text_diff}")
+    print(f"image mismatches: {image_diff}")
+    print(f"legacy:  {legacy * 1e6 / len(entries):8.1f} us/entry")
+    print(f"extract: {fast * 1e6 / len(entries):8.1f} us/entry")
+    print(f"speedup: {legacy / fast:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Posts synthetic Telegram updates to the bot's webhook server, the way Telegram
+# would, and reports the status codes and response times it gets back.
+#
+#   WEBHOOK_URL=https://example.org/telegram/webhook WEBHOOK_SECRET=s3cret python bot.py
+#   python bench/webhook_client.py --secret s3cret --text /stats
+#   python bench/webhook_client.py --secret s3cret --count 200 --concurrency 20
+#
+# Every update is a private-chat message from --chat-id, so command handlers that
+# only answer in private chats reply to that chat. --wrong-secret checks that the
+# server refuses requests without the right X-Telegram-Bot-Api-Secret-Token.
+
+import argparse
+import json
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def make_update(update_id, chat_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id % 1000000,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': 'Webhook'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Webhook'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+            if text.startswith('/') else [],
+        },
+    }
+
+
+def post_update(session, url, secret, update):
+    body = json.dumps(update).encode('utf-8')
+    started = time.perf_counter()
+    try:
+        resp = session.post(url, data=body, timeout=10, headers={
+            'Content-Type': 'application/json',
+            'X-Telegram-Bot-Api-Secret-Token': secret,
+        })
+        status = resp.status_code
+    except requests.RequestException as e:
+        status = type(e).__name__
+    return status, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default=f"http://127.0.0.1:{os.getenv('WEBHOOK_PORT', '8443')}"
+                                         f"{os.getenv('WEBHOOK_PATH', '/telegram/webhook')}")
+    parser.add_argument('--secret', default=os.getenv('WEBHOOK_SECRET', ''))
+    parser.add_argument('--wrong-secret', action='store_true', help='send a bad secret token (expect 403)')
+    parser.add_argument('--chat-id', type=int, default=1)
+    parser.add_argument('--text', default='/stats')
+    parser.add_argument('--count', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--repeat-id', action='store_true', help='reuse one update_id (expect duplicates dropped)')
+    args = parser.parse_args()
+
+    secret = 'wrong-' + args.secret if args.wrong_secret else args.secret
+    first_id = random.randint(1, 10 ** 9)
+    updates = [make_update(first_id if args.repeat_id else first_id + i, args.chat_id, args.text)
+               for i in range(args.count)]
+
+    session = requests.Session()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda update: post_update(session, args.url, secret, update), updates))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(latency for _, latency in results)
+    statuses = Counter(status for status, _ in results)
+    print(f"sent {len(results)} updates to {args.url} in {wall:.2f}s")
+    print("status:  " + ', '.join(f"{status}={n}" for status, n in sorted(statuses.items(), key=str)))
+    print(f"latency: p50 {latencies[len(latencies) // 2] * 1000:.1f}ms  max {latencies[-1] * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
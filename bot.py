@@ -1,7 +1,5 @@
 import telebot
-from telebot.types import ReplyKeyboardMarkup, KeyboardButton
-from groq import Groq
-import feedparser
+from telebot.types import ReplyKeyboardMarkup, KeyboardButton, InputMediaPhoto
 import time
 import threading
 import requests
@@ -9,13 +7,33 @@ import datetime
 import re
 import io
 import random
+import queue
+import hmac
+import secrets
+import signal
+import cProfile
+import pstats
+import sys
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import base64
 import json
 import logging
 import pytz
-from bs4 import BeautifulSoup
 import os
 import textwrap
+import html
+import email.utils
+import calendar
+import xml.etree.ElementTree as ET
+from itertools import islice
+import hashlib
+import math
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, urlunparse, urljoin, parse_qsl, urlencode
+from requests.adapters import HTTPAdapter
 
 # ────────────────────────────────────────────────
 #                SETTINGS
@@ -25,6 +43,8 @@ TOKEN = os.getenv("BOT_TOKEN")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 CLOUDFLARE_API_TOKEN = os.getenv("CLOUDFLARE_API_TOKEN")
 CLOUDFLARE_ACCOUNT_ID = os.getenv("CLOUDFLARE_ACCOUNT_ID")
+CLOUDFLARE_API_BASE = os.getenv("CLOUDFLARE_API_BASE", "https://api.cloudflare.com/client/v4")
+GOOGLE_NEWS_BASE = os.getenv("GOOGLE_NEWS_BASE", "https://news.google.com")
 
 CHANNEL_ID = int(os.getenv("CHANNEL_ID", "-1003783912194"))  # значение по умолчанию, если не задан
 
@@ -37,11 +57,13 @@ if not CLOUDFLARE_API_TOKEN:
 if not CLOUDFLARE_ACCOUNT_ID:
     raise ValueError("CLOUDFLARE_ACCOUNT_ID не задан")
 
-LAST_PINNED_SUMMARY_ID = None
 LAST_PINNED_FILE = "last_pinned_summary.json"
 
-bot = telebot.TeleBot(TOKEN)
-groq_client = Groq(api_key=GROQ_API_KEY)
+# In webhook mode handlers run synchronously on the webhook pool, which is what
+# bounds them (see process_webhook_update), rather than on telebot's own threads
+bot = telebot.TeleBot(TOKEN, threaded=not os.getenv("WEBHOOK_URL"))
+groq_client = None  # created on first use, importing groq is slow
+groq_client_lock = threading.Lock()
 # Logging
 logging.basicConfig(
     filename='bot_log.txt',
@@ -71,120 +93,1360 @@ KEYWORDS = [
     'bitcoin', 'altcoins'
 ]
 
-SENT_FILE = "sent_news.json"
+NEGATIVE_KEYWORDS = [
+    'stepmother', 'estate', 'robbery', 'war in ukraine',
+    'divorce', 'cheated', 'tennis', 'fiancee', 'married', 'hair',
+    'brother',
+]
+
+# Channels: if CHANNELS_FILE exists the bot posts to every channel listed there,
+# each with its own keywords, negative keywords and summary slots; missing fields
+# fall back to KEYWORDS / NEGATIVE_KEYWORDS / SUMMARY_SLOTS. Feeds are fetched,
+# matched and illustrated once and each item goes to every channel it matches.
+#   [{"name": "markets", "chat_id": -100123, "keywords": ["gold", "stocks"]},
+#    {"name": "musk", "chat_id": -100456, "keywords": ["tesla", "spacex"], "summary_slots": "evening=20:00"}]
+# Without the file there is one channel, CHANNEL_ID, using the global lists.
+CHANNELS_FILE = os.getenv("CHANNELS_FILE", "channels.json")
+
+# Feed fetching: every feed is pulled in parallel over one keep-alive pool,
+# with a cap on simultaneous requests to the same host (4 feeds share news.google.com)
+FEED_FETCH_WORKERS = 8
+FEED_PER_HOST_LIMIT = 2
+
+# Adaptive polling: each feed is polled about once per average gap between its
+# newest items, within these bounds and with +-jitter. A feed that comes back
+# unchanged waits a little longer next time.
+FEED_MIN_INTERVAL = 60
+FEED_MAX_INTERVAL = 30 * 60
+FEED_DEFAULT_INTERVAL = 210
+FEED_INTERVAL_JITTER = 0.2
+FEED_IDLE_BACKOFF = 1.25
+FEED_RATE_SAMPLE = 10
+FEED_BATCH_WINDOW = 20  # feeds due within this many seconds are polled together
+
+# Per-host circuit breaker for feed and image hosts: after HOST_FAILURE_THRESHOLD
+# consecutive failures (timeouts, connection errors, 5xx, 429) the host is skipped
+# for a backoff that doubles with each further failure. Once it expires a single
+# probe request is let through; success closes the circuit.
+HOST_FAILURE_THRESHOLD = 3
+HOST_BACKOFF_BASE = 60
+HOST_BACKOFF_MAX = 60 * 60
+
+# Prometheus-style metrics on http://METRICS_HOST:METRICS_PORT/metrics (0 disables)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# /profile writes cProfile stats here and replies with the top functions by own time
+PROFILE_DIR = "profiles"
+PROFILE_TOP_N = 20
+
+# Summary slots as "name=HH:MM" pairs in SUMMARY_TIMEZONE. A slot missed while the
+# bot was down is posted on startup if it is no older than the grace period.
+SUMMARY_TIMEZONE = os.getenv("SUMMARY_TIMEZONE", "Asia/Bangkok")
+SUMMARY_SLOTS = os.getenv("SUMMARY_SLOTS", "morning=07:30,noon=12:45,evening=20:00")
+SUMMARY_CATCHUP_GRACE_MINUTES = int(os.getenv("SUMMARY_CATCHUP_GRACE_MINUTES", "90"))
+
+# Rolling summary: a background thread keeps each channel's summary up to date as
+# news arrives, so slot posts and /summary publish it without waiting on Groq.
+# News is condensed in batches (map), the batch notes are merged into the final
+# bullets (reduce), and every Groq answer is cached by its prompt's hash so only
+# the newest batch is redone. The last good summary is used if Groq is down.
+SUMMARY_BATCH_SIZE = 10
+SUMMARY_MAX_BATCHES = 6
+SUMMARY_REFRESH_DELAY = 60  # wait after new news so a whole cycle lands in one rebuild
+SUMMARY_CACHE_MAX = 256
+
+# Incremental parsing: feeds are read item by item and a cycle stops reading a
+# feed after this many consecutive already-seen (or too old) items. Only feeds
+# whose items come newest first stop early; one seen out of date order (Google
+# News search is ordered by relevance) is always read in full.
+INCREMENTAL_STOP_AFTER_KNOWN = 8
+
+# Image acquisition (article image download or Cloudflare generation) runs in
+# this many worker threads, ahead of the send loop
+IMAGE_WORKERS = 4
+
+# Downloaded and generated images are kept on disk, keyed by source URL or prompt,
+# and evicted least-recently-used once the directory exceeds the byte budget
+IMAGE_CACHE_DIR = "image_cache"
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# Items without an image in the feed get the article's og:image/twitter:image,
+# read from the page <head> (streamed, at most OG_IMAGE_MAX_BYTES) before falling
+# back to Cloudflare generation. Lookups are cached per article URL; pages without
+# one are remembered for a shorter time
+OG_IMAGE_MAX_BYTES = 64 * 1024
+OG_IMAGE_TIMEOUT = 8
+OG_IMAGE_TTL_HOURS = 24
+OG_IMAGE_MISS_TTL_HOURS = 6
+OG_IMAGE_CACHE_MAX = 2000
+
+# Album mode: a cycle's photo posts for a channel go out as one send_media_group
+# album with a caption per photo (Telegram allows up to 10); a lone item, or one
+# without an image, is posted the usual way
+ALBUM_MODE = os.getenv("ALBUM_MODE", "1") != "0"
+ALBUM_MAX_ITEMS = 10
+POSTS_PER_CYCLE = ALBUM_MAX_ITEMS if ALBUM_MODE else 4
+
+# Backlog: matched items wait in a persistent queue and each cycle posts the best
+# POSTS_PER_CYCLE per channel. Score = sum of matched keyword weights (default 1)
+# x source weight (default 1), halved every BACKLOG_HALF_LIFE_HOURS of age.
+# Items older than BACKLOG_MAX_AGE_HOURS, or the lowest scored beyond
+# BACKLOG_MAX_ITEMS, are dropped without posting.
+KEYWORD_WEIGHTS = {
+    'elon musk': 2.0, 'tesla': 1.5, 'spacex': 1.5, 'neuralink': 1.5, 'nvidia': 1.5,
+    'fed': 1.5, 'inflation': 1.5, 'gold price': 1.5, 'stock market': 1.3,
+}
+SOURCE_WEIGHTS = {
+    'Bloomberg Markets/News': 1.3,
+    'MarketWatch Top Stories': 1.1,
+}
+BACKLOG_FILE = "backlog.json"
+BACKLOG_HALF_LIFE_HOURS = 3
+BACKLOG_MAX_AGE_HOURS = 6
+BACKLOG_MAX_ITEMS = 300
+
+# Outbound Telegram pacing: Telegram allows about 20 messages per minute into one
+# group/channel and about 30 requests per second overall
+TELEGRAM_CHAT_RATE = 20 / 60
+TELEGRAM_CHAT_BURST = 3
+TELEGRAM_GLOBAL_RATE = 25
+TELEGRAM_MAX_RETRIES = 3
+
+SENT_FILE = "sent_news.json"  # legacy full-set dump, migrated into the journal once
+SENT_JOURNAL_FILE = "sent_news.jsonl"
+SENT_NEWS_MAX_AGE_DAYS = int(os.getenv("SENT_NEWS_MAX_AGE_DAYS", "14"))
+FEED_CACHE_FILE = "feed_cache.json"
+RECENT_STORIES_FILE = "recent_stories.json"
+PHOTO_FILE_IDS_FILE = "photo_file_ids.json"
+DAILY_NEWS_FILE = "daily_news.jsonl"
+DAILY_NEWS_CAPACITY = 200
+DAILY_NEWS_TEXT_CHARS = 200
+PHOTO_FILE_IDS_MAX = 2000
+
+# Near-duplicate detection: a story whose title shares at least this fraction of
+# words with one posted in the last NEAR_DUP_WINDOW_HOURS is dropped
+NEAR_DUP_WINDOW_HOURS = 24
+NEAR_DUP_MIN_SIMILARITY = 0.6
+
+# Current Google News RSS links carry an opaque article id; the publisher URL is
+# looked up the way the news.google.com article page does it (two small requests)
+# and kept, so each id is resolved once. GOOGLE_NEWS_DECODE=0 turns lookups off.
+GOOGLE_NEWS_DECODE = os.getenv("GOOGLE_NEWS_DECODE", "1") != "0"
+GOOGLE_NEWS_TIMEOUT = 8
+GOOGLE_NEWS_LINKS_MAX = 4000
 LAST_NOTIF_FILE = "last_notification_id.json"
 LAST_SENT_SUMMARIES_FILE = "last_sent_summaries.json"
 
-sent_news = set()
-daily_news = []
-last_check_time = datetime.datetime.now(datetime.timezone.utc)
-last_notification_message_id = None
-last_sent_summaries = {'morning': None, 'noon': None, 'evening': None}
+# Small state (feed validators, recent stories, photo file_ids, message ids) lives
+# in one snapshot; the per-feature files above are only read to migrate from them.
+# sent_news and daily_news keep their own append-only journals. Routine changes
+# only mark the snapshot dirty; it is rewritten at most every STATE_SAVE_INTERVAL
+# seconds and on shutdown.
+STATE_FILE = "bot_state.json"
+STATE_SAVE_INTERVAL = 30
+
+# Inbound updates: with WEBHOOK_URL set, Telegram pushes updates to a local HTTP
+# server (put it behind an HTTPS reverse proxy) instead of the bot long-polling.
+# Requests must carry WEBHOOK_SECRET in X-Telegram-Bot-Api-Secret-Token; if it is
+# not set a random one is generated on each start and registered with Telegram.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_WORKERS = 4
+WEBHOOK_MAX_PENDING = 100  # updates queued beyond this are refused with 503 and retried by Telegram
+WEBHOOK_MAX_BODY = 1024 * 1024
+
+# Startup: the "Bot started" message is skipped if the previous start was this recent,
+# and polling is restarted in-process with a growing delay if it stops
+STARTUP_MESSAGE_MIN_INTERVAL_HOURS = 6
+POLLING_TIMEOUT = 120
+LONG_POLLING_TIMEOUT = 90
+POLLING_RESTART_MIN_DELAY = 5
+POLLING_RESTART_MAX_DELAY = 300
+
+sent_news = {}  # unique key -> unix time it was recorded
+sent_news_lock = threading.Lock()
+sent_journal_lines = 0
+last_sent_compaction = 0.0
+daily_news = deque(maxlen=DAILY_NEWS_CAPACITY)  # NewsRecord items collected for the next summary
+daily_news_lock = threading.Lock()
+daily_news_lines = 0
+feed_schedule = {}  # url -> {'interval', 'next_at', 'last_check'}
+feed_schedule_lock = threading.Lock()
+unordered_feeds = set()  # urls whose items were seen out of date order
+host_health = {}  # host -> {'failures', 'open_until', 'probing' (probe start time)}; healthy hosts are absent
+host_health_lock = threading.Lock()
+last_notification_ids = {}  # channel name -> message id of the "Posted N items" notice
+last_pinned_summary_ids = {}  # channel name -> message id of the pinned summary
+last_sent_summaries = {}  # channel name -> {slot: date it was last posted}
+summary_marks = {}  # channel name -> unix time of its last summary
+rolling_summaries = {}  # channel name -> {'text', 'key', 'last_ts', 'built_at'} for the news since that summary
+last_good_summaries = {}  # channel name -> {'text', 'built_at'}, kept across summaries and restarts
+summary_cache = {}  # sha256 of prompt -> Groq answer, oldest first
+summary_lock = threading.Lock()
+summary_dirty = threading.Event()
+feed_cache = {}  # url -> {'etag', 'last_modified', 'body_hash'}
+feed_cache_lock = threading.Lock()
+recent_stories = deque()  # (timestamp, canonical url, title tokens), oldest first
+recent_stories_lock = threading.Lock()
+photo_file_ids = {}  # sha256 of image bytes -> Telegram file_id, oldest first
+photo_file_ids_lock = threading.Lock()
+google_news_links = {}  # Google News article id -> publisher url, or None if it has none; oldest first
+google_news_lock = threading.Lock()
+og_image_cache = {}  # canonical article url -> [image url or None, expires at], oldest first
+og_image_lock = threading.Lock()
+state_lock = threading.Lock()
+state_dirty = threading.Event()
+backlog = {}  # unique key -> {'title', 'link', 'source', 'channels', 'in_flight', 'posted', 'priority', 'ts', 'entry'}
+backlog_dropped = {}  # unique key -> unix time it was dropped unposted, so it isn't queued again
+backlog_lock = threading.Lock()
+backlog_dirty = threading.Event()
+backlog_drain_lock = threading.Lock()
+last_started_at = None  # unix time of the previous start, from the snapshot
+shutdown_event = threading.Event()
+
+
+class NewsRecord:
+    __slots__ = ('title', 'source', 'ts', 'text', 'channels')
+
+    def __init__(self, title, source, ts, text='', channels=()):
+        self.title = title
+        self.source = source
+        self.ts = ts
+        self.text = text
+        self.channels = tuple(channels)  # empty for records written before channels existed: all of them
+
+    def to_json(self):
+        return [self.title, self.source, self.ts, self.text, list(self.channels)]
+
+    def for_channel(self, name):
+        return not self.channels or name in self.channels
 
 
 # ────────────────────────────────────────────────
-#                LOAD / SAVE FUNCTIONS
+#                METRICS
 # ────────────────────────────────────────────────
-# (все функции load/save остались без изменений)
+# Counters and latency histograms per pipeline stage, exported in Prometheus text
+# format by a small local HTTP server and summarized by the /stats command.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+metrics_lock = threading.Lock()
+metric_counters = {}    # (name, labels) -> value
+metric_histograms = {}  # (name, labels) -> {'buckets': [...], 'sum', 'count', 'max'}
+metric_gauges = {}      # name -> callable returning the current value
+
+
+def inc_counter(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        metric_counters[key] = metric_counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        hist = metric_histograms.get(key)
+        if hist is None:
+            hist = {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0, 'max': 0.0}
+            metric_histograms[key] = hist
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                hist['buckets'][i] += 1
+                break
+        hist['sum'] += seconds
+        hist['count'] += 1
+        hist['max'] = max(hist['max'], seconds)
+
+
+@contextmanager
+def timed(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
 
 
-def load_sent_news():
-    global sent_news
+def set_gauge(name, fn):
+    metric_gauges[name] = fn
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def render_metrics():
+    lines = []
+    with metrics_lock:
+        counters = sorted(metric_counters.items())
+        histograms = sorted((key, dict(h, buckets=list(h['buckets']))) for key, h in metric_histograms.items())
+
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            lines.append(f"# TYPE newsbot_{name} counter")
+            typed.add(name)
+        lines.append(f"newsbot_{name}{format_labels(labels)} {value}")
+
+    for (name, labels), hist in histograms:
+        if name not in typed:
+            lines.append(f"# TYPE newsbot_{name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, hist['buckets']):
+            cumulative += count
+            lines.append(f"newsbot_{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"newsbot_{name}_bucket{format_labels(labels, [('le', '+Inf')])} {hist['count']}")
+        lines.append(f"newsbot_{name}_sum{format_labels(labels)} {hist['sum']:.6f}")
+        lines.append(f"newsbot_{name}_count{format_labels(labels)} {hist['count']}")
+
+    for name, fn in sorted(metric_gauges.items()):
+        try:
+            value = fn()
+        except Exception:
+            continue
+        lines.append(f"# TYPE newsbot_{name} gauge")
+        lines.append(f"newsbot_{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def format_stats():
+    # Short plain-text digest for /stats: latency per stage, then hit rates and queues
+    with metrics_lock:
+        histograms = sorted(metric_histograms.items())
+        counters = dict(metric_counters)
+
+    lines = ["Stage latency (calls, avg, max):"]
+    stages = {}
+    for (name, labels), hist in histograms:
+        total = stages.setdefault(name, {'count': 0, 'sum': 0.0, 'max': 0.0})
+        total['count'] += hist['count']
+        total['sum'] += hist['sum']
+        total['max'] = max(total['max'], hist['max'])
+    for name, total in stages.items():
+        avg = total['sum'] / total['count'] if total['count'] else 0
+        lines.append(f"  {name}: {total['count']}, {avg:.3f}s, {total['max']:.3f}s")
+
+    def counter_sum(name, **match):
+        return sum(v for (n, labels), v in counters.items()
+                   if n == name and all(dict(labels).get(k) == want for k, want in match.items()))
+
+    lines.append("Caches:")
+    for label, name in (('feeds', 'feed_fetch_total'), ('images', 'image_cache_total'), ('file_ids', 'photo_file_id_total')):
+        hits = counter_sum(name, result='hit') + counter_sum(name, result='not_modified') + counter_sum(name, result='unchanged')
+        total = counter_sum(name)
+        rate = f"{hits / total:.0%}" if total else 'n/a'
+        lines.append(f"  {label}: {hits}/{total} hits ({rate})")
+
+    lines.append("Gauges:")
+    for name, fn in sorted(metric_gauges.items()):
+        try:
+            lines.append(f"  {name}: {fn()}")
+        except Exception:
+            continue
+    return '\n'.join(lines)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+set_gauge('telegram_queue_depth', lambda: telegram_queue.qsize())
+set_gauge('image_queue_depth', lambda: image_executor._work_queue.qsize())
+set_gauge('feed_queue_depth', lambda: feed_executor._work_queue.qsize())
+set_gauge('daily_news_items', lambda: len(daily_news))
+set_gauge('sent_news_keys', lambda: len(sent_news))
+set_gauge('backlog_items', lambda: len(backlog))
+set_gauge('og_image_cache_entries', lambda: len(og_image_cache))
+set_gauge('hosts_circuit_open', lambda: sum(h['failures'] >= HOST_FAILURE_THRESHOLD for h in list(host_health.values())))
+set_gauge('html_extract_cache_hits', lambda: extract_html.cache_info().hits)
+
+
+# ────────────────────────────────────────────────
+#                PROFILING
+# ────────────────────────────────────────────────
+# /profile arms cProfile for the next N background cycles (or runs one summary
+# under it). While nothing is armed the checker only reads one int per cycle.
+# On Python 3.12+ (runtime.txt) cProfile sits on sys.monitoring: only one
+# profiler can be active in the process, and it records every thread, so runs
+# are serialized by profile_run_lock and reports cover the whole process.
+
+PROFILE_ALL_THREADS = sys.version_info >= (3, 12)
+
+profile_state = {'cycles': 0, 'chat_id': None}
+profile_lock = threading.Lock()
+profile_run_lock = threading.Lock()
+
+
+def format_profile(profiler, top):
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    lines = [f"{'own s':>7} {'cum s':>7} {'calls':>7}  function"]
+    for (filename, lineno, func), (_, ncalls, tottime, cumtime, _) in rows:
+        where = f"{os.path.basename(filename)}:{lineno}" if lineno else filename
+        lines.append(f"{tottime:7.3f} {cumtime:7.3f} {ncalls:7d}  {func} ({where})")
+    lines.append(f"total {stats.total_tt:.3f}s")
+    return '\n'.join(lines)
+
+
+def run_profiled(label, fn, *args, **kwargs):
+    # Returns (result, stats path, report), or None without calling fn when
+    # another profiling run is active. Before 3.12 only the calling thread is
+    # profiled and worker threads show up as time waiting on their futures.
+    if not profile_run_lock.acquire(blocking=False):
+        return None
     try:
-        with open(SENT_FILE, 'r', encoding='utf-8') as f:
-            sent_news = set(json.load(f))
-    except (FileNotFoundError, json.JSONDecodeError):
-        sent_news = set()
-    logging.info(f"Loaded {len(sent_news)} already sent news items")
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:  # another sys.monitoring tool, e.g. a debugger
+            logging.warning(f"Profiler not started: {e}")
+            return None
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+    finally:
+        profile_run_lock.release()
+    path = None
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{label}_{datetime.datetime.now():%Y%m%d_%H%M%S}.prof")
+        profiler.dump_stats(path)
+    except OSError as e:
+        logging.warning(f"Failed to write profile: {e}")
+    return result, path, format_profile(profiler, PROFILE_TOP_N)
 
 
-def save_sent_news():
+def send_profile_report(chat_id, label, path, report):
+    scope = "all threads" if PROFILE_ALL_THREADS else "calling thread"
+    text = f"Profile: {label} ({scope})\nStats file: {path}\n\n{report}"
     try:
-        with open(SENT_FILE, 'w', encoding='utf-8') as f:
-            json.dump(list(sent_news), f, ensure_ascii=False)
+        telegram_request('send_message', chat_id, text[:4000])
     except Exception as e:
-        logging.error(f"Error saving sent_news: {e}")
+        logging.error(f"Failed to send profile report: {e}")
 
 
-def load_last_notification_id():
-    global last_notification_message_id
-    try:
-        with open(LAST_NOTIF_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            last_notification_message_id = data.get("message_id")
-        if last_notification_message_id:
-            logging.info(f"Loaded last notification ID: {last_notification_message_id}")
-    except Exception:
-        last_notification_message_id = None
+def take_profiled_cycle():
+    # Returns the chat to report to if this cycle should be profiled
+    if not profile_state['cycles']:
+        return None
+    with profile_lock:
+        if profile_state['cycles'] <= 0:
+            return None
+        profile_state['cycles'] -= 1
+        return profile_state['chat_id']
 
 
-def save_last_notification_id():
-    global last_notification_message_id
-    if last_notification_message_id is None:
+def start_metrics_server():
+    if not METRICS_PORT:
         return
     try:
-        with open(LAST_NOTIF_FILE, 'w', encoding='utf-8') as f:
-            json.dump({"message_id": last_notification_message_id}, f)
-    except Exception as e:
-        logging.warning(f"Failed to save last_notification_message_id: {e}")
+        server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), MetricsHandler)
+    except OSError as e:
+        logging.warning(f"Metrics server not started on {METRICS_HOST}:{METRICS_PORT}: {e}")
+        return
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics').start()
+    logging.info(f"Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
 
 
-def load_last_sent_summaries():
-    global last_sent_summaries
-    try:
-        with open(LAST_SENT_SUMMARIES_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            last_sent_summaries = data
-        logging.info(f"Loaded last summary dates: {last_sent_summaries}")
-    except Exception:
-        last_sent_summaries = {'morning': None, 'noon': None, 'evening': None}
+# ────────────────────────────────────────────────
+#                LOAD / SAVE FUNCTIONS
+# ────────────────────────────────────────────────
+# (все функции load/save остались без изменений)
 
 
-def load_last_pinned_id():
-    global LAST_PINNED_SUMMARY_ID
+def load_sent_news():
+    # sent_news.jsonl is an append-only journal of [key, timestamp] lines;
+    # a torn last line after a crash is simply skipped
+    global sent_news, sent_journal_lines
+    sent_news = {}
+    sent_journal_lines = 0
     try:
-        with open(LAST_PINNED_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            LAST_PINNED_SUMMARY_ID = data.get("pinned_message_id")
-        if LAST_PINNED_SUMMARY_ID:
-            logging.info(f"Loaded last pinned summary id: {LAST_PINNED_SUMMARY_ID}")
-    except Exception:
-        LAST_PINNED_SUMMARY_ID = None
+        with open(SENT_JOURNAL_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                sent_journal_lines += 1
+                try:
+                    key, ts = json.loads(line)
+                    sent_news[key] = ts
+                except (ValueError, TypeError):
+                    continue
+    except FileNotFoundError:
+        try:
+            with open(SENT_FILE, 'r', encoding='utf-8') as f:
+                now = time.time()
+                sent_news = {key: now for key in json.load(f)}
+            logging.info(f"Migrating {len(sent_news)} keys from {SENT_FILE} to {SENT_JOURNAL_FILE}")
+        except (FileNotFoundError, json.JSONDecodeError):
+            sent_news = {}
+    compact_sent_news()
+    logging.info(f"Loaded {len(sent_news)} already sent news items")
 
 
-def save_last_pinned_id():
-    global LAST_PINNED_SUMMARY_ID
-    if LAST_PINNED_SUMMARY_ID is None:
-        return
+def mark_sent(key):
+    global sent_journal_lines
+    with sent_news_lock:
+        if key in sent_news:
+            return
+        ts = time.time()
+        sent_news[key] = ts
+        try:
+            with open(SENT_JOURNAL_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps([key, ts], ensure_ascii=False) + '\n')
+            sent_journal_lines += 1
+        except Exception as e:
+            logging.error(f"Error appending to sent_news journal: {e}")
+
+
+def compact_sent_news():
+    # Drops keys older than SENT_NEWS_MAX_AGE_DAYS and rewrites the journal atomically
+    global sent_news, sent_journal_lines, last_sent_compaction
+    cutoff = time.time() - SENT_NEWS_MAX_AGE_DAYS * 86400
+    with sent_news_lock:
+        kept = {key: ts for key, ts in sent_news.items() if ts >= cutoff}
+        tmp_path = SENT_JOURNAL_FILE + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for key, ts in kept.items():
+                    f.write(json.dumps([key, ts], ensure_ascii=False) + '\n')
+            os.replace(tmp_path, SENT_JOURNAL_FILE)
+        except Exception as e:
+            logging.error(f"Error compacting sent_news journal: {e}")
+            return
+        evicted = len(sent_news) - len(kept)
+        sent_news = kept
+        sent_journal_lines = len(kept)
+        last_sent_compaction = time.time()
+    if evicted:
+        logging.info(f"Evicted {evicted} sent news keys older than {SENT_NEWS_MAX_AGE_DAYS} days")
+
+
+def maybe_compact_sent_news():
+    if sent_journal_lines > 2 * len(sent_news) + 500 or time.time() - last_sent_compaction > 86400:
+        compact_sent_news()
+
+
+def load_daily_news():
+    # daily_news.jsonl gets one line per accepted item and is truncated after each
+    # summary, so news collected before a restart still makes it into the next one
+    global daily_news_lines
+    lines = 0
+    with daily_news_lock:
+        daily_news.clear()
+        try:
+            with open(DAILY_NEWS_FILE, 'r', encoding='utf-8') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        daily_news.append(NewsRecord(*json.loads(line)))
+                    except (ValueError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+        daily_news_lines = lines
+    if daily_news_lines > 2 * DAILY_NEWS_CAPACITY:
+        rewrite_daily_news()
+    if daily_news:
+        summary_dirty.set()
+    logging.info(f"Loaded {len(daily_news)} news items for the next summary")
+
+
+def rewrite_daily_news():
+    global daily_news_lines
+    with daily_news_lock:
+        tmp_path = DAILY_NEWS_FILE + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in daily_news:
+                    f.write(json.dumps(record.to_json(), ensure_ascii=False) + '\n')
+            os.replace(tmp_path, DAILY_NEWS_FILE)
+            daily_news_lines = len(daily_news)
+        except Exception as e:
+            logging.warning(f"Failed to rewrite daily news: {e}")
+
+
+def add_daily_news(title, source, desc='', channels=()):
+    global daily_news_lines
+    text = clean_html(desc)[:DAILY_NEWS_TEXT_CHARS] if desc else ''
+    record = NewsRecord(title, source, time.time(), text, channels)
+    with daily_news_lock:
+        daily_news.append(record)
+        try:
+            with open(DAILY_NEWS_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record.to_json(), ensure_ascii=False) + '\n')
+            daily_news_lines += 1
+        except Exception as e:
+            logging.warning(f"Failed to append daily news: {e}")
+    if daily_news_lines > 2 * DAILY_NEWS_CAPACITY:
+        rewrite_daily_news()
+    summary_dirty.set()
+
+
+def channel_daily_news(name):
+    # Records for this channel that arrived since its last summary
+    since = summary_marks.get(name, 0)
+    with daily_news_lock:
+        return [record for record in daily_news if record.ts > since and record.for_channel(name)]
+
+
+def clear_daily_news(name, until=None):
+    # Marks the channel's news up to `until` as summarized and drops records that
+    # every channel they belong to has already summarized. The watermark never
+    # moves backwards.
+    with summary_lock:
+        summary_marks[name] = max(summary_marks.get(name, 0), until or time.time())
+        rolling_summaries.pop(name, None)
+    with daily_news_lock:
+        kept = [
+            record for record in daily_news
+            if any(record.ts > summary_marks.get(channel, 0)
+                   for channel in (record.channels or CHANNELS_BY_NAME))
+        ]
+        daily_news.clear()
+        daily_news.extend(kept)
+    rewrite_daily_news()
+    if channel_daily_news(name):
+        summary_dirty.set()  # rebuild for what came in after the summary
+    save_state()
+
+
+def read_legacy_state():
+    state = {}
+    for name, path in (
+        ('feed_cache', FEED_CACHE_FILE),
+        ('recent_stories', RECENT_STORIES_FILE),
+        ('photo_file_ids', PHOTO_FILE_IDS_FILE),
+        ('last_notification', LAST_NOTIF_FILE),
+        ('last_sent_summaries', LAST_SENT_SUMMARIES_FILE),
+        ('last_pinned', LAST_PINNED_FILE),
+    ):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                state[name] = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+    if isinstance(state.get('last_notification'), dict):
+        state['last_notification_id'] = state.pop('last_notification').get("message_id")
+    if isinstance(state.get('last_pinned'), dict):
+        state['last_pinned_id'] = state.pop('last_pinned').get("pinned_message_id")
+    return state
+
+
+def load_state():
+    global feed_cache, photo_file_ids, last_notification_ids, last_sent_summaries
+    global last_pinned_summary_ids, summary_marks, last_good_summaries, last_started_at
+    migrated = False
     try:
-        with open(LAST_PINNED_FILE, 'w', encoding='utf-8') as f:
-            json.dump({"pinned_message_id": LAST_PINNED_SUMMARY_ID}, f)
-    except Exception as e:
-        logging.warning(f"Failed to save last pinned id: {e}")
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        state = read_legacy_state()
+        migrated = bool(state)
+        if migrated:
+            logging.info(f"Migrating {', '.join(state)} into {STATE_FILE}")
+    except json.JSONDecodeError as e:
+        logging.error(f"Corrupt {STATE_FILE}, starting with empty state: {e}")
+        state = {}
+
+    feed_cache = state.get('feed_cache') or {}
+    photo_file_ids = state.get('photo_file_ids') or {}
+    # Single-channel snapshots kept these per bot; they belong to the first channel
+    primary = CHANNELS[0]['name']
+    if state.get('last_notification_id') is not None:
+        state.setdefault('last_notification_ids', {primary: state['last_notification_id']})
+    if state.get('last_pinned_id') is not None:
+        state.setdefault('last_pinned_ids', {primary: state['last_pinned_id']})
+    summaries = state.get('last_sent_summaries') or {}
+    if not all(isinstance(value, dict) for value in summaries.values()):
+        summaries = {primary: summaries}
+    last_notification_ids = state.get('last_notification_ids') or {}
+    last_pinned_summary_ids = state.get('last_pinned_ids') or {}
+    last_sent_summaries = summaries
+    summary_marks = state.get('summary_marks') or {}
+    last_good_summaries = state.get('last_good_summaries') or {}
+    last_started_at = state.get('started_at')
+    with host_health_lock:
+        host_health.clear()
+        for host, (failures, open_until) in (state.get('host_health') or {}).items():
+            host_health[host] = {'failures': failures, 'open_until': open_until, 'probing': 0}
+    with feed_schedule_lock:
+        feed_schedule.clear()
+        for url, interval in (state.get('feed_intervals') or {}).items():
+            feed_schedule_entry(url, interval)
+    unordered_feeds.clear()
+    unordered_feeds.update(state.get('unordered_feeds') or [])
+    with google_news_lock:
+        google_news_links.clear()
+        google_news_links.update(state.get('google_news_links') or {})
+    now = time.time()
+    with og_image_lock:
+        og_image_cache.clear()
+        for url, (image, expires_at) in (state.get('og_images') or {}).items():
+            if expires_at > now:
+                og_image_cache[url] = [image, expires_at]
+    with recent_stories_lock:
+        recent_stories.clear()
+        for ts, url, tokens in state.get('recent_stories') or []:
+            recent_stories.append((ts, url, frozenset(tokens)))
+        expire_recent_stories(time.time())
+
+    logging.info(
+        f"Loaded state: {len(feed_cache)} feed validators, {len(recent_stories)} recent stories, "
+        f"{len(photo_file_ids)} photo file_ids, last summaries {last_sent_summaries}"
+    )
+    if migrated:
+        save_state()
+
+
+def mark_state_dirty():
+    state_dirty.set()
+
+
+def state_flusher():
+    while True:
+        state_dirty.wait()
+        time.sleep(STATE_SAVE_INTERVAL)
+        save_state()
+        if backlog_dirty.is_set():
+            save_backlog()
+
+
+def save_state():
+    # Built and written under one lock, so an older snapshot can't replace a newer one
+    with state_lock:
+        state_dirty.clear()
+        with feed_cache_lock:
+            cache_snapshot = dict(feed_cache)
+        with recent_stories_lock:
+            stories_snapshot = [[ts, url, sorted(tokens)] for ts, url, tokens in recent_stories]
+        with photo_file_ids_lock:
+            file_ids_snapshot = dict(photo_file_ids)
+        with host_health_lock:
+            health_snapshot = {host: [h['failures'], h['open_until']] for host, h in host_health.items()}
+        with feed_schedule_lock:
+            intervals_snapshot = {url: round(entry['interval']) for url, entry in feed_schedule.items()}
+        with og_image_lock:
+            og_snapshot = {url: [image, round(expires_at)] for url, (image, expires_at) in og_image_cache.items()}
+        with google_news_lock:
+            google_snapshot = dict(google_news_links)
+        with summary_lock:
+            good_snapshot = {name: dict(summary) for name, summary in last_good_summaries.items()}
+        state = {
+            'started_at': last_started_at,
+            'last_notification_ids': dict(last_notification_ids),
+            'last_pinned_ids': dict(last_pinned_summary_ids),
+            'last_sent_summaries': {name: dict(sent) for name, sent in list(last_sent_summaries.items())},
+            'summary_marks': dict(summary_marks),
+            'last_good_summaries': good_snapshot,
+            'feed_cache': cache_snapshot,
+            'feed_intervals': intervals_snapshot,
+            'unordered_feeds': sorted(unordered_feeds),
+            'host_health': health_snapshot,
+            'recent_stories': stories_snapshot,
+            'photo_file_ids': file_ids_snapshot,
+            'og_images': og_snapshot,
+            'google_news_links': google_snapshot,
+        }
+        tmp_path = STATE_FILE + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, STATE_FILE)
+        except Exception as e:
+            logging.warning(f"Failed to save state: {e}")
+
 
+# ────────────────────────────────────────────────
+#                KEYWORD MATCHING
+# ────────────────────────────────────────────────
+
+def build_trie_regex(words):
+    # Alternation factored by common prefixes ('gold|gold price' -> 'gold(?:\ price)?'),
+    # so the regex engine does not retry every keyword at each position
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def walk(node):
+        optional = '' in node
+        branches = [re.escape(ch) + walk(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        group = '(?:' + '|'.join(branches) + ')'
+        return group + '?' if optional else group
+
+    return walk(trie)
+
+
+def build_keyword_pattern(keywords):
+    # Whole-word, case-insensitive match for the whole list in one pass.
+    # All-caps acronyms ('US') stay case-sensitive so they don't hit the pronoun "us"
+    words = set()
+    acronyms = set()
+    for kw in keywords:
+        kw = kw.strip()
+        if not kw:
+            continue
+        if kw.isupper():
+            acronyms.add(kw)
+        else:
+            words.add(kw.lower())
 
-def save_last_sent_summaries():
+    alternatives = []
+    if words:
+        alternatives.append(build_trie_regex(words))
+    if acronyms:
+        alternatives.append('(?-i:' + build_trie_regex(acronyms) + ')')
+    if not alternatives:
+        return re.compile(r'(?!)')
+    return re.compile(r'\b(?:' + '|'.join(alternatives) + r')\b', re.IGNORECASE)
+
+
+def load_channels():
     try:
-        with open(LAST_SENT_SUMMARIES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(last_sent_summaries, f)
-    except Exception as e:
-        logging.warning(f"Failed to save last_sent_summaries: {e}")
+        with open(CHANNELS_FILE, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        logging.info(f"Loaded {len(config)} channels from {CHANNELS_FILE}")
+    except FileNotFoundError:
+        config = [{'name': 'main', 'chat_id': CHANNEL_ID}]
+
+    channels = []
+    for item in config:
+        keywords = item.get('keywords') or KEYWORDS
+        negative_keywords = item.get('negative_keywords', NEGATIVE_KEYWORDS)
+        channels.append({
+            'name': str(item.get('name') or item['chat_id']),
+            'chat_id': int(item['chat_id']),
+            'keywords': keywords,
+            'negative_keywords': negative_keywords,
+            'summary_slots': item.get('summary_slots', SUMMARY_SLOTS),
+            'keyword_pattern': build_keyword_pattern(keywords),
+            'negative_pattern': build_keyword_pattern(negative_keywords),
+        })
+    return channels
+
+
+CHANNELS = load_channels()
+CHANNELS_BY_NAME = {channel['name']: channel for channel in CHANNELS}
+
+# One pattern over every channel's keywords, so each entry is scanned once no
+# matter how many channels there are; channels_for_keyword then routes the hits
+KEYWORD_PATTERN = build_keyword_pattern({kw for channel in CHANNELS for kw in channel['keywords']})
+NEGATIVE_PATTERN = build_keyword_pattern({kw for channel in CHANNELS for kw in channel['negative_keywords']})
+
+
+@lru_cache(maxsize=4096)
+def channels_for_keyword(hit, negative=False):
+    # Inverted index: matched text (as it appeared, so acronym case still counts)
+    # -> names of the channels whose own list matches it. 'gold price' also routes
+    # to channels that only follow 'gold'.
+    key = 'negative_pattern' if negative else 'keyword_pattern'
+    return frozenset(channel['name'] for channel in CHANNELS if channel[key].search(hit))
+
+
+def route_entry(text):
+    # Returns (channel names in CHANNELS order, matched keywords lowercased)
+    hits = {m.group(0) for m in KEYWORD_PATTERN.finditer(text)} if text else set()
+    if not hits:
+        return (), set()
+    targets = set()
+    for hit in hits:
+        targets |= channels_for_keyword(hit)
+    for hit in {m.group(0) for m in NEGATIVE_PATTERN.finditer(text)}:
+        targets -= channels_for_keyword(hit, True)
+    return tuple(channel['name'] for channel in CHANNELS if channel['name'] in targets), {h.lower() for h in hits}
+
+
+# ────────────────────────────────────────────────
+#                FEED FETCHING
+# ────────────────────────────────────────────────
+
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=FEED_FETCH_WORKERS))
+http_session.mount('http://', HTTPAdapter(pool_connections=16, pool_maxsize=FEED_FETCH_WORKERS))
+
+feed_executor = ThreadPoolExecutor(max_workers=FEED_FETCH_WORKERS, thread_name_prefix='feed')
+host_slots = {}
+host_slots_lock = threading.Lock()
+
+
+def get_host_slot(url):
+    host = urlparse(url).netloc
+    with host_slots_lock:
+        slot = host_slots.get(host)
+        if slot is None:
+            slot = threading.BoundedSemaphore(FEED_PER_HOST_LIMIT)
+            host_slots[host] = slot
+    return slot
+
+
+def host_available(url):
+    # False while the host's circuit is open. When the backoff has expired the
+    # first caller gets True and becomes the probe; others keep being refused
+    # until it reports back (or HOST_BACKOFF_BASE passes without an answer).
+    host = urlparse(url).netloc
+    now = time.time()
+    with host_health_lock:
+        health = host_health.get(host)
+        if health is None or health['failures'] < HOST_FAILURE_THRESHOLD:
+            return True
+        if now < health['open_until'] or now - health['probing'] < HOST_BACKOFF_BASE:
+            inc_counter('host_circuit_rejected_total', host=host)
+            return False
+        health['probing'] = now
+    logging.info(f"Probing {host} after backoff")
+    return True
+
+
+def record_host_result(url, ok):
+    host = urlparse(url).netloc
+    with host_health_lock:
+        if ok:
+            health = host_health.pop(host, None)
+            if health is None or health['failures'] < HOST_FAILURE_THRESHOLD:
+                return
+        else:
+            health = host_health.setdefault(host, {'failures': 0, 'open_until': 0, 'probing': 0})
+            health['failures'] += 1
+            health['probing'] = 0
+            if health['failures'] < HOST_FAILURE_THRESHOLD:
+                return
+            backoff = min(HOST_BACKOFF_BASE * 2 ** (health['failures'] - HOST_FAILURE_THRESHOLD), HOST_BACKOFF_MAX)
+            health['open_until'] = time.time() + backoff
+    if ok:
+        logging.info(f"Host {host} recovered, circuit closed")
+    else:
+        logging.warning(f"Circuit open for {host} after {health['failures']} failures, next try in {backoff}s")
+    mark_state_dirty()
 
 
-def fetch_feed(url):
+def is_host_failure(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+def fetch_feed(url, source_name=None):
+    # Returns the raw feed bytes, None when the feed has not changed since the last
+    # fetch (304 or identical body), or "" on error
+    feed = source_name or urlparse(url).netloc
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
         'Accept': 'application/rss+xml, application/xml, text/xml;q=0.9',
     }
+    with feed_cache_lock:
+        cached = dict(feed_cache.get(url, {}))
+    if not host_available(url):
+        inc_counter('feed_fetch_total', feed=feed, result='circuit_open')
+        return ""
+    if cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    if cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+
     try:
-        resp = requests.get(url, headers=headers, timeout=15)
+        with get_host_slot(url), timed('feed_fetch_seconds', feed=feed):
+            resp = http_session.get(url, headers=headers, timeout=15)
+        record_host_result(url, not is_host_failure(resp.status_code))
+        if resp.status_code == 304:
+            logging.debug(f"Feed not modified: {url}")
+            inc_counter('feed_fetch_total', feed=feed, result='not_modified')
+            return None
         resp.raise_for_status()
-        return resp.text
+        inc_counter('feed_bytes_total', len(resp.content), feed=feed)
+
+        # Some hosts ignore validators and resend the same document, so compare bodies too
+        body_hash = hashlib.sha1(resp.content).hexdigest()
+        with feed_cache_lock:
+            feed_cache[url] = {
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+                'body_hash': body_hash,
+            }
+        if body_hash == cached.get('body_hash'):
+            logging.debug(f"Feed body unchanged: {url}")
+            inc_counter('feed_fetch_total', feed=feed, result='unchanged')
+            return None
+        inc_counter('feed_fetch_total', feed=feed, result='fetched')
+        return resp.content
+    except requests.RequestException as e:
+        if not isinstance(e, requests.HTTPError):
+            record_host_result(url, False)
+        logging.error(f"Error fetching {url}: {e}")
+        inc_counter('feed_fetch_total', feed=feed, result='error')
+        return ""
     except Exception as e:
         logging.error(f"Error fetching {url}: {e}")
+        inc_counter('feed_fetch_total', feed=feed, result='error')
         return ""
 
 
+def fetch_feeds(feeds):
+    # Yields (source_name, url, content) in completion order, so the caller can
+    # parse each feed while the slower ones are still downloading
+    futures = {feed_executor.submit(fetch_feed, url, source_name): (source_name, url) for source_name, url in feeds}
+    try:
+        for future in as_completed(futures):
+            source_name, url = futures[future]
+            yield source_name, url, future.result()
+    finally:
+        mark_state_dirty()
+
+
+# ────────────────────────────────────────────────
+#                FEED SCHEDULE
+# ────────────────────────────────────────────────
+
+def feed_schedule_entry(url, interval=FEED_DEFAULT_INTERVAL):
+    # Caller holds feed_schedule_lock. A feed seen for the first time is first
+    # polled somewhere within its interval, so startup doesn't hit every feed at once.
+    entry = feed_schedule.get(url)
+    if entry is None:
+        now = time.time()
+        entry = feed_schedule[url] = {
+            'interval': interval,
+            'next_at': now + random.uniform(min(FEED_MIN_INTERVAL, interval), interval),
+            'last_check': now,
+        }
+    return entry
+
+
+def feed_last_check(url):
+    with feed_schedule_lock:
+        return feed_schedule_entry(url)['last_check']
+
+
+def estimate_feed_interval(timestamps, now):
+    # The newest k items arrived over (now - oldest of them), so a feed that
+    # went quiet gets a longer estimate even if its last items came in a burst
+    newest = sorted(timestamps, reverse=True)[:FEED_RATE_SAMPLE]
+    if len(newest) < 2:
+        return None
+    return max(now - newest[-1], 0) / len(newest)
+
+
+def reschedule_feed(url, content, timestamps, now):
+    with feed_schedule_lock:
+        entry = feed_schedule_entry(url)
+        interval = entry['interval']
+        if content is None:
+            interval *= FEED_IDLE_BACKOFF
+        elif content:
+            estimate = estimate_feed_interval(timestamps, now)
+            if estimate is not None:
+                interval = (interval + estimate) / 2
+        interval = min(max(interval, FEED_MIN_INTERVAL), FEED_MAX_INTERVAL)
+        entry['interval'] = interval
+        entry['next_at'] = now + interval * random.uniform(1 - FEED_INTERVAL_JITTER, 1 + FEED_INTERVAL_JITTER)
+        entry['last_check'] = now
+    logging.debug(f"Next poll of {url} in {interval:.0f}s")
+
+
+def due_feeds(now):
+    with feed_schedule_lock:
+        return [
+            (source_name, url) for source_name, url in RSS_FEEDS
+            if feed_schedule_entry(url)['next_at'] <= now + FEED_BATCH_WINDOW
+        ]
+
+
+def next_feed_due():
+    with feed_schedule_lock:
+        return min(feed_schedule_entry(url)['next_at'] for _, url in RSS_FEEDS)
+
+
+# ────────────────────────────────────────────────
+#                FEED PARSING
+# ────────────────────────────────────────────────
+# Items are streamed out of the XML one at a time, so a cycle that only needs the
+# few newest items never builds the rest. Anything the streaming reader can't
+# handle goes through feedparser instead.
+
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+MEDIA_NS = '{http://search.yahoo.com/mrss/}'
+CONTENT_NS = '{http://purl.org/rss/1.0/modules/content/}'
+FEED_ITEM_TAGS = {'item', ATOM_NS + 'entry'}
+
+
+def parse_feed_date(value):
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            dt = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.astimezone(datetime.timezone.utc).utctimetuple()
+
+
+def add_media(entry, elem):
+    name = elem.tag[len(MEDIA_NS):]
+    if name == 'content' and elem.get('url'):
+        entry.setdefault('media_content', []).append(dict(elem.attrib))
+    elif name == 'thumbnail' and elem.get('url'):
+        entry.setdefault('media_thumbnail', []).append(dict(elem.attrib))
+    elif name == 'group':
+        for child in elem:
+            if child.tag.startswith(MEDIA_NS):
+                add_media(entry, child)
+
+
+def add_enclosure(entry, href, mime_type):
+    # FeedParserDict derives entry.enclosures from links with rel="enclosure"
+    import feedparser
+    entry.setdefault('links', []).append(feedparser.FeedParserDict(rel='enclosure', href=href, type=mime_type))
+
+
+def build_stream_entry(elem):
+    # Produces the same keys feedparser would for the fields this bot reads
+    import feedparser
+    entry = feedparser.FeedParserDict()
+    for child in elem:
+        tag = child.tag
+        name = tag.rsplit('}', 1)[-1]
+        text = (child.text or '').strip()
+        if tag.startswith(MEDIA_NS):
+            add_media(entry, child)
+        elif name == 'title':
+            entry['title'] = text
+        elif name == 'link':
+            href = child.get('href')
+            if href is None:
+                entry['link'] = text
+            elif child.get('rel', 'alternate') == 'alternate':
+                entry.setdefault('link', href)
+            elif child.get('rel') == 'enclosure':
+                add_enclosure(entry, href, child.get('type', ''))
+        elif name in ('description', 'summary'):
+            entry['summary'] = text
+        elif tag == CONTENT_NS + 'encoded' or tag == ATOM_NS + 'content':
+            entry['content'] = [feedparser.FeedParserDict(value=text or ''.join(child.itertext()).strip())]
+        elif name in ('pubDate', 'published', 'issued'):
+            entry['published'] = text
+            entry['published_parsed'] = parse_feed_date(text)
+        elif name in ('updated', 'modified', 'date'):
+            entry['updated'] = text
+            entry['updated_parsed'] = parse_feed_date(text)
+        elif name == 'enclosure' and child.get('url'):
+            add_enclosure(entry, child.get('url'), child.get('type', ''))
+    return entry
+
+
+def iter_feed_entries(content, feed):
+    # Generator of entries, newest first as served. Falls back to feedparser when
+    # the XML is malformed or contains no recognizable items.
+    produced = 0
+    try:
+        for _, elem in ET.iterparse(io.BytesIO(content), events=('end',)):
+            if elem.tag in FEED_ITEM_TAGS:
+                entry = build_stream_entry(elem)
+                elem.clear()
+                produced += 1
+                yield entry
+    except ET.ParseError as e:
+        logging.info(f"Streaming parse failed after {produced} items, using feedparser: {e}")
+    else:
+        if produced:
+            return
+    inc_counter('feed_parse_fallback_total', feed=feed)
+    import feedparser
+    yield from islice(feedparser.parse(content).entries, produced, None)
+
+
+def parse_feed_entries(content, source_name=None):
+    # iter_feed_entries plus metrics; only the time spent parsing is counted,
+    # not the time the caller spends on each entry
+    feed = source_name or 'unknown'
+    entries = iter_feed_entries(content, feed)
+    spent = 0.0
+    count = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                entry = next(entries)
+            except StopIteration:
+                break
+            finally:
+                spent += time.perf_counter() - start
+            count += 1
+            yield entry
+    finally:
+        entries.close()
+        observe('feed_parse_seconds', spent, feed=feed)
+        inc_counter('feed_entries_parsed_total', count, feed=feed)
+
+
+# ────────────────────────────────────────────────
+#                DUPLICATE DETECTION
+# ────────────────────────────────────────────────
+
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'ocid', 'cmpid', 'mod', 'taid', 'guccounter')
+TITLE_STOPWORDS = {
+    'a', 'an', 'the', 'and', 'or', 'of', 'to', 'in', 'on', 'for', 'at', 'by', 'with',
+    'as', 'is', 'are', 'was', 'be', 'its', 'it', 'from', 'after', 'over', 'says', 'say',
+}
+TITLE_TOKEN_RE = re.compile(r"[a-z0-9$%€£.]+")
+GOOGLE_NEWS_URL_RE = re.compile(rb'https?://[\x21-\x7e]+')
+GOOGLE_NEWS_SIGNATURE_RE = re.compile(r'data-n-a-sg="([^"]+)"')
+GOOGLE_NEWS_TIMESTAMP_RE = re.compile(r'data-n-a-ts="([^"]+)"')
+
+
+def fetch_google_news_target(article_id):
+    # The article page carries a signature and timestamp for the id; posting them
+    # to batchexecute returns the publisher URL. None when Google has no URL for it.
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+    page_url = f"{GOOGLE_NEWS_BASE}/rss/articles/{article_id}"
+    resp = http_session.get(page_url, headers=headers, timeout=GOOGLE_NEWS_TIMEOUT)
+    record_host_result(page_url, not is_host_failure(resp.status_code))
+    resp.raise_for_status()
+    signature = GOOGLE_NEWS_SIGNATURE_RE.search(resp.text)
+    timestamp = GOOGLE_NEWS_TIMESTAMP_RE.search(resp.text)
+    if not signature or not timestamp:
+        return None
+
+    request = json.dumps([
+        "garturlreq",
+        [["X", "X", ["X", "X"], None, None, 1, 1, "US:en", None, 1, None, None, None, None, None, 0, 1],
+         "X", "X", 1, [1, 1, 1], 1, 1, None, 0, 0, None, 0],
+        article_id, int(timestamp.group(1)), signature.group(1),
+    ])
+    resp = http_session.post(
+        f"{GOOGLE_NEWS_BASE}/_/DotsSplashUi/data/batchexecute",
+        data={'f.req': json.dumps([[["Fbv4je", request, None, "generic"]]])},
+        headers=dict(headers, **{'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8'}),
+        timeout=GOOGLE_NEWS_TIMEOUT,
+    )
+    record_host_result(page_url, not is_host_failure(resp.status_code))
+    resp.raise_for_status()
+    # ")]}'" guard line, blank line, then a JSON array of envelopes
+    for envelope in json.loads(resp.text.split('\n\n', 1)[1]):
+        if len(envelope) > 2 and envelope[1] == "Fbv4je" and envelope[2]:
+            target = json.loads(envelope[2])[1]
+            return target if urlparse(target).scheme in ('http', 'https') else None
+    return None
+
+
+def resolve_google_news_link(link, lookup=True):
+    # news.google.com/rss/articles/<id> links carry the publisher URL base64-encoded
+    # inside the id (older format) or behind an opaque id (current format), which
+    # is looked up once and remembered; with lookup=False only remembered ids are
+    # resolved. Unresolved links are returned as they are.
+    parsed = urlparse(link)
+    if parsed.netloc != 'news.google.com' or '/articles/' not in parsed.path:
+        return link
+    article_id = parsed.path.rsplit('/', 1)[-1]
+    try:
+        raw = base64.urlsafe_b64decode(article_id + '=' * (-len(article_id) % 4))
+        m = GOOGLE_NEWS_URL_RE.search(raw)
+    except (ValueError, TypeError):
+        m = None
+    if m:
+        return m.group(0).decode('ascii', 'ignore')
+
+    with google_news_lock:
+        known = article_id in google_news_links
+        target = google_news_links.get(article_id)
+    if known:
+        return target or link
+    if not lookup or not GOOGLE_NEWS_DECODE or not host_available(GOOGLE_NEWS_BASE):
+        return link
+    try:
+        with timed('google_news_resolve_seconds'):
+            target = fetch_google_news_target(article_id)
+    except (requests.RequestException, ValueError, IndexError, TypeError) as e:
+        if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+            record_host_result(GOOGLE_NEWS_BASE, False)
+        logging.warning(f"Could not resolve Google News link {link}: {e}")
+        inc_counter('google_news_resolve_total', result='error')
+        return link
+    inc_counter('google_news_resolve_total', result='resolved' if target else 'missing')
+    with google_news_lock:
+        google_news_links[article_id] = target
+        while len(google_news_links) > GOOGLE_NEWS_LINKS_MAX:
+            del google_news_links[next(iter(google_news_links))]
+    mark_state_dirty()
+    return target or link
+
+
+def canonical_url(link, lookup=True):
+    if not link:
+        return ''
+    parsed = urlparse(resolve_google_news_link(link.strip(), lookup))
+    host = parsed.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = [(k, v) for k, v in parse_qsl(parsed.query) if not k.lower().startswith(TRACKING_PARAMS)]
+    path = parsed.path.rstrip('/') or '/'
+    return urlunparse(('https', host, path, '', urlencode(query), ''))
+
+
+def title_tokens(title):
+    title = (title or '').lower()
+    # Google News titles end with " - Publisher"
+    if ' - ' in title:
+        title = title.rsplit(' - ', 1)[0]
+    return frozenset(t.strip('.') for t in TITLE_TOKEN_RE.findall(title) if t.strip('.') not in TITLE_STOPWORDS)
+
+
+def expire_recent_stories(now):
+    cutoff = now - NEAR_DUP_WINDOW_HOURS * 3600
+    while recent_stories and recent_stories[0][0] < cutoff:
+        recent_stories.popleft()
+
+
+def find_near_duplicate(title, link, lookup=True):
+    # Returns the reason the story duplicates a recent one, or None
+    url = canonical_url(link, lookup)
+    tokens = title_tokens(title)
+    with recent_stories_lock:
+        expire_recent_stories(time.time())
+        for _, seen_url, seen_tokens in recent_stories:
+            if url and url == seen_url:
+                return f"same article {url}"
+            if tokens and seen_tokens:
+                similarity = len(tokens & seen_tokens) / len(tokens | seen_tokens)
+                if similarity >= NEAR_DUP_MIN_SIMILARITY:
+                    return f"title {similarity:.0%} similar to '{' '.join(sorted(seen_tokens))}'"
+    return None
+
+
+def remember_story(title, link):
+    url = canonical_url(link)  # may look the link up, so outside the lock
+    with recent_stories_lock:
+        recent_stories.append((time.time(), url, title_tokens(title)))
+    mark_state_dirty()
+
+
 def escape_md_v2(text):
     if not text:
         return ''
@@ -214,70 +1476,308 @@ def get_article_image(entry):
             continue
         if isinstance(value, list):
             for item in value:
-                text = item.get('value', '')
-                if not text:
-                    continue
-                m = re.search(r'<img[^>]+src=["\'](.*?)["\']', text, re.IGNORECASE)
-                if m:
-                    return m.group(1)
+                image = extract_html(item.get('value', ''))[1]
+                if image:
+                    return image
         elif isinstance(value, str):
-            m = re.search(r'<img[^>]+src=["\'](.*?)["\']', value, re.IGNORECASE)
-            if m:
-                return m.group(1)
+            image = extract_html(value)[1]
+            if image:
+                return image
     return None
 
 
+image_cache_lock = threading.Lock()
+
+
+def image_cache_path(key):
+    return os.path.join(IMAGE_CACHE_DIR, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+
+def image_cache_get(key):
+    path = image_cache_path(key)
+    kind = key.split(':', 1)[0]
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        inc_counter('image_cache_total', kind=kind, result='miss')
+        return None
+    inc_counter('image_cache_total', kind=kind, result='hit')
+    try:
+        os.utime(path, None)  # mtime doubles as the LRU timestamp
+    except OSError:
+        pass
+    return data
+
+
+def image_cache_put(key, data):
+    if not data:
+        return
+    path = image_cache_path(key)
+    try:
+        os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"Failed to cache image: {e}")
+        return
+    evict_image_cache()
+
+
+def evict_image_cache():
+    with image_cache_lock:
+        files = []
+        total = 0
+        try:
+            with os.scandir(IMAGE_CACHE_DIR) as it:
+                for item in it:
+                    if item.is_file() and not item.name.endswith('.tmp'):
+                        st = item.stat()
+                        files.append((st.st_mtime, st.st_size, item.path))
+                        total += st.st_size
+        except OSError:
+            return
+        if total <= IMAGE_CACHE_MAX_BYTES:
+            return
+        files.sort()
+        removed = 0
+        for _, size, path in files:
+            if total <= IMAGE_CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        logging.info(f"Image cache: evicted {removed} files, {total} bytes kept")
+
+
 def generate_cloudflare_image(prompt):
-    url = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/ai/run/@cf/stabilityai/stable-diffusion-xl-base-1.0"
+    url = f"{CLOUDFLARE_API_BASE}/accounts/{CLOUDFLARE_ACCOUNT_ID}/ai/run/@cf/stabilityai/stable-diffusion-xl-base-1.0"
     headers = {
         "Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}",
         "Content-Type": "application/json",
     }
     payload = {"prompt": prompt, "num_steps": 20, "guidance": 7.5}
 
+    cache_key = f"prompt:sdxl-base-1.0:{prompt}"
+    cached = image_cache_get(cache_key)
+    if cached:
+        logging.info("Cloudflare image served from cache")
+        return cached
+
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=90)
+        with timed('cloudflare_generate_seconds'):
+            r = http_session.post(url, headers=headers, json=payload, timeout=90)
+        inc_counter('cloudflare_requests_total', status=r.status_code)
         if r.status_code != 200:
             logging.error(f"Cloudflare error {r.status_code}: {r.text[:200]}")
             return None
 
+        image_bytes = None
         if 'image/' in r.headers.get('Content-Type', ''):
-            return r.content
-
-        data = r.json()
-        if data.get("success") and "result" in data:
-            result = data["result"]
-            if isinstance(result, dict) and "image" in result:
-                return base64.b64decode(result["image"])
-            if isinstance(result, str):
-                return base64.b64decode(result)
-        return None
+            image_bytes = r.content
+        else:
+            data = r.json()
+            if data.get("success") and "result" in data:
+                result = data["result"]
+                if isinstance(result, dict) and "image" in result:
+                    image_bytes = base64.b64decode(result["image"])
+                elif isinstance(result, str):
+                    image_bytes = base64.b64decode(result)
+
+        image_cache_put(cache_key, image_bytes)
+        return image_bytes
     except Exception as e:
         logging.error(f"Cloudflare exception: {e}")
         return None
 
 
 def download_image(url):
+    cache_key = f"url:{url}"
+    cached = image_cache_get(cache_key)
+    if cached:
+        return cached
+
+    host = urlparse(url).netloc
+    if not host_available(url):
+        inc_counter('image_download_total', host=host, result='circuit_open')
+        return None
     try:
-        r = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=10)
+        with timed('image_download_seconds', host=host):
+            r = http_session.get(url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=10)
+        record_host_result(url, not is_host_failure(r.status_code))
         if r.status_code == 200 and 'image' in r.headers.get('Content-Type', ''):
+            inc_counter('image_download_total', host=host, result='ok')
+            image_cache_put(cache_key, r.content)
             return r.content
+        inc_counter('image_download_total', host=host, result='rejected')
         return None
     except Exception as e:
+        if isinstance(e, requests.RequestException):
+            record_host_result(url, False)
         logging.error(f"Error downloading image {url}: {e}")
+        inc_counter('image_download_total', host=host, result='error')
         return None
 
 
-def clean_html(text):
-    if not text:
-        return ''
+HTML_HEAD_END_RE = re.compile(rb'</head\s*>|<body\b', re.IGNORECASE)
+META_TAG_RE = re.compile(r'<meta\b[^>]*>', re.IGNORECASE)
+META_ATTR_RE = re.compile(r'([a-zA-Z:_-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))')
+OG_IMAGE_KEYS = ('og:image:secure_url', 'og:image', 'og:image:url', 'twitter:image', 'twitter:image:src')
+
+
+def read_html_head(resp):
+    # Reads the streamed page only until </head> (or <body>), at most OG_IMAGE_MAX_BYTES
+    head = bytearray()
+    for chunk in resp.iter_content(8192):
+        start = max(0, len(head) - 16)
+        head += chunk
+        m = HTML_HEAD_END_RE.search(head, start)
+        if m:
+            return bytes(head[:m.start()])
+        if len(head) >= OG_IMAGE_MAX_BYTES:
+            break
+    return bytes(head[:OG_IMAGE_MAX_BYTES])
+
+
+def find_og_image(head, base_url):
+    found = {}
+    for tag in META_TAG_RE.finditer(head.decode('utf-8', 'replace')):
+        attrs = {}
+        for name, dq, sq, bare in META_ATTR_RE.findall(tag.group(0)):
+            attrs[name.lower()] = html.unescape(dq or sq or bare).strip()
+        key = (attrs.get('property') or attrs.get('name') or '').lower()
+        if key in OG_IMAGE_KEYS and attrs.get('content'):
+            found.setdefault(key, attrs['content'])
+    for key in OG_IMAGE_KEYS:
+        if key in found:
+            return urljoin(base_url, found[key])
+    return None
+
+
+def resolve_og_image(link):
+    # Returns the article's og:image/twitter:image URL, or None. Google News links
+    # are resolved to the publisher first (usually already done by the backlog).
+    url = resolve_google_news_link(link or '')
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or parsed.netloc == 'news.google.com':
+        # An unresolved Google News link only leads to a script redirect page
+        return None
+    key = canonical_url(url)
+    now = time.time()
+    with og_image_lock:
+        cached = og_image_cache.get(key)
+    if cached and cached[1] > now:
+        inc_counter('og_image_lookup_total', result='cached')
+        return cached[0]
+
+    host = parsed.netloc
+    if not host_available(url):
+        inc_counter('og_image_lookup_total', result='circuit_open')
+        return None
+    image = None
+    try:
+        with timed('og_image_lookup_seconds', host=host):
+            with http_session.get(url, stream=True, timeout=OG_IMAGE_TIMEOUT, headers={
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+                'Accept': 'text/html,application/xhtml+xml',
+            }) as resp:
+                record_host_result(url, not is_host_failure(resp.status_code))
+                if is_host_failure(resp.status_code):
+                    inc_counter('og_image_lookup_total', result='error')
+                    return None
+                if resp.status_code == 200 and 'html' in resp.headers.get('Content-Type', ''):
+                    image = find_og_image(read_html_head(resp), resp.url)
+    except requests.RequestException as e:
+        record_host_result(url, False)
+        logging.warning(f"og:image lookup failed for {url}: {e}")
+        inc_counter('og_image_lookup_total', result='error')
+        return None
+
+    inc_counter('og_image_lookup_total', result='found' if image else 'missing')
+    ttl = OG_IMAGE_TTL_HOURS if image else OG_IMAGE_MISS_TTL_HOURS
+    with og_image_lock:
+        og_image_cache.pop(key, None)
+        og_image_cache[key] = [image, now + ttl * 3600]
+        while len(og_image_cache) > OG_IMAGE_CACHE_MAX:
+            del og_image_cache[next(iter(og_image_cache))]
+    mark_state_dirty()
+    return image
+
+
+HTML_TOKEN_RE = re.compile(r'<!--.*?-->|<(/?)([a-zA-Z][a-zA-Z0-9]*)\b([^<>]*)>', re.DOTALL)
+HTML_LEFTOVER_TAG_RE = re.compile(r'<[a-zA-Z/!]')
+IMG_SRC_RE = re.compile(r'\bsrc\s*=\s*["\'](.*?)["\']', re.IGNORECASE | re.DOTALL)
+WHITESPACE_RE = re.compile(r'\s+')
+HTML_SKIP_TAGS = {'script', 'style', 'template'}
+
+
+def extract_html_fallback(text):
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(text, 'html.parser')
-    cleaned = soup.get_text(separator=' ', strip=True)
-    cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-    return cleaned
+    cleaned = WHITESPACE_RE.sub(' ', soup.get_text(separator=' ', strip=True)).strip()
+    img = soup.find('img', src=True)
+    return cleaned, (img['src'] if img else None)
+
+
+@lru_cache(maxsize=512)
+def extract_html(text):
+    with timed('html_extract_seconds'):
+        return scan_html(text)
+
+
+def scan_html(text):
+    # One pass over the markup: returns (visible text, first <img> src).
+    # Falls back to BeautifulSoup only when the markup doesn't tokenize cleanly.
+    if not text:
+        return '', None
+    if '<' not in text:
+        return WHITESPACE_RE.sub(' ', html.unescape(text)).strip(), None
+
+    parts = []
+    image = None
+    skip_until = None
+    pos = 0
+    for m in HTML_TOKEN_RE.finditer(text):
+        if skip_until is None:
+            parts.append(text[pos:m.start()])
+        pos = m.end()
+        closing, tag, attrs = m.groups()
+        if tag is None:  # comment
+            continue
+        tag = tag.lower()
+        if skip_until is not None:
+            if closing and tag == skip_until:
+                skip_until = None
+            continue
+        if not closing and tag in HTML_SKIP_TAGS:
+            skip_until = tag
+        elif tag == 'img' and image is None:
+            src = IMG_SRC_RE.search(attrs)
+            if src:
+                image = html.unescape(src.group(1))
+    if skip_until is None:
+        parts.append(text[pos:])
+
+    joined = ' '.join(parts)
+    if skip_until is not None or HTML_LEFTOVER_TAG_RE.search(joined):
+        inc_counter('html_extract_fallback_total')
+        return extract_html_fallback(text)
+    return WHITESPACE_RE.sub(' ', html.unescape(joined)).strip(), image
 
 
-def send_news_photo(entry, source_name):
+def clean_html(text):
+    return extract_html(text)[0]
+
+
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='image')
+
+
+def build_news_post(entry, source_name):
     title = (entry.get('title') or 'No title').strip()
     link = entry.get('link', 'no link')
     published = entry.get('published') or entry.get('updated', 'date unknown')
@@ -303,141 +1803,604 @@ def send_news_photo(entry, source_name):
         f"[{escape_md_v2(source_name)} • {escape_md_v2(published[:16])}]({escape_md_v2(link)})"
     )
 
+    return {
+        'title': title,
+        'link': link,
+        'published': published,
+        'desc_short': desc_short,
+        'caption': caption,
+        'source': source_name,
+        'image': None,
+    }
+
+
+def acquire_news_image(entry, post):
     image_bytes = None
     img_url = get_article_image(entry)
     if img_url:
         image_bytes = download_image(img_url)
 
     if not image_bytes:
-        prompt = f"Professional news illustration: {title}. {desc_short}. Modern style, tech and space theme, high quality, realistic"
+        og_url = resolve_og_image(post['link'])
+        if og_url and og_url != img_url:
+            image_bytes = download_image(og_url)
+
+    if not image_bytes:
+        prompt = f"Professional news illustration: {post['title']}. {post['desc_short']}. Modern style, tech and space theme, high quality, realistic"
         image_bytes = generate_cloudflare_image(prompt)
+    return image_bytes
+
+
+def prepare_news_post(entry, source_name):
+    # Builds the caption and starts fetching/generating the image in the background,
+    # so image latency overlaps with the pacing between posts
+    post = build_news_post(entry, source_name)
+    post['image'] = image_executor.submit(acquire_news_image, entry, post)
+    return post
 
+
+# ────────────────────────────────────────────────
+#                BACKLOG
+# ────────────────────────────────────────────────
+# sent_news only gets an item once Telegram has accepted it in every channel it
+# was routed to (or it turned out to duplicate a posted story); until then it
+# sits here and counts as known. 'channels' are still to be picked, 'in_flight'
+# ones were handed to the sender, and 'posted' means remember_story has it.
+
+BACKLOG_ENTRY_FIELDS = ('title', 'link', 'summary', 'content', 'published', 'updated',
+                        'media_content', 'media_thumbnail', 'links')
+
+
+def entry_to_json(entry):
+    return {field: entry[field] for field in BACKLOG_ENTRY_FIELDS if field in entry}
+
+
+def entry_from_json(data):
+    import feedparser
+    entry = feedparser.FeedParserDict(data)
+    for field in ('content', 'links'):
+        if field in data:
+            entry[field] = [feedparser.FeedParserDict(item) for item in data[field]]
+    return entry
+
+
+def load_backlog():
     try:
-        if image_bytes:
-            photo = io.BytesIO(image_bytes)
-            photo.name = 'news.jpg'
-            bot.send_photo(
-                chat_id=CHANNEL_ID,
-                photo=photo,
-                caption=caption,
-                parse_mode='MarkdownV2'
-            )
+        with open(BACKLOG_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        data = {}
+    with backlog_lock:
+        backlog.clear()
+        for item in data.get('items', []):
+            if item['key'] in sent_news:
+                continue
+            # Sends still queued when the process stopped are picked again
+            channels = item['channels'] + item.pop('in_flight', [])
+            item['channels'] = [name for name in channels if name in CHANNELS_BY_NAME]
+            item['in_flight'] = []
+            item.setdefault('posted', False)
+            if item['channels']:
+                item['entry'] = entry_from_json(item['entry'])
+                backlog[item.pop('key')] = item
+        backlog_dropped.clear()
+        backlog_dropped.update(data.get('dropped', {}))
+    logging.info(f"Loaded {len(backlog)} backlog items")
+
+
+def save_backlog():
+    backlog_dirty.clear()
+    with backlog_lock:
+        data = {
+            'items': [dict(item, key=key, entry=entry_to_json(item['entry'])) for key, item in backlog.items()],
+            'dropped': dict(backlog_dropped),
+        }
+    tmp_path = BACKLOG_FILE + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, BACKLOG_FILE)
+    except Exception as e:
+        logging.warning(f"Failed to save backlog: {e}")
+
+
+def is_known(unique):
+    return unique in sent_news or unique in backlog or unique in backlog_dropped
+
+
+def backlog_priority(hits, source_name, ts):
+    # log2 of the score, less a term that grows at the same rate for every item,
+    # so the order never changes as items age and needs no re-scoring
+    weight = sum(KEYWORD_WEIGHTS.get(hit, 1.0) for hit in hits) * SOURCE_WEIGHTS.get(source_name, 1.0)
+    return math.log2(weight) + ts / (BACKLOG_HALF_LIFE_HOURS * 3600)
+
+
+def drop_backlog_item(unique, now):
+    # Caller holds backlog_lock
+    backlog.pop(unique, None)
+    backlog_dropped[unique] = now
+    inc_counter('backlog_dropped_total')
+
+
+def enqueue_backlog(unique, entry, source_name, channels, hits, pub_ts=None):
+    now = time.time()
+    ts = min(pub_ts or now, now)
+    with backlog_lock:
+        if now - ts > BACKLOG_MAX_AGE_HOURS * 3600:
+            drop_backlog_item(unique, now)
+            return
+        backlog[unique] = {
+            'title': (entry.get('title') or '').strip(),
+            'link': entry.get('link', ''),
+            'source': source_name,
+            'channels': list(channels),
+            'in_flight': [],
+            'posted': False,
+            'priority': backlog_priority(hits, source_name, ts),
+            'ts': ts,
+            'entry': entry,
+        }
+        if len(backlog) > BACKLOG_MAX_ITEMS:
+            drop_backlog_item(min(backlog, key=lambda key: backlog[key]['priority']), now)
+    inc_counter('backlog_enqueued_total')
+
+
+def drain_backlog(limit=POSTS_PER_CYCLE):
+    # Takes the best items, up to `limit` per channel, marks those channels in
+    # flight and starts the images. Returns ([(entry, source_name, post, channels)],
+    # {channel: count}); the send path reports back through backlog_delivered().
+    # Serialized: the startup catch-up and background_checker can both drain
+    with backlog_drain_lock:
+        now = time.time()
+        picked = []
+        counts = {}
+        with backlog_lock:
+            for unique in [key for key, item in backlog.items() if now - item['ts'] > BACKLOG_MAX_AGE_HOURS * 3600]:
+                drop_backlog_item(unique, now)
+            for unique in [key for key, ts in backlog_dropped.items() if now - ts > SENT_NEWS_MAX_AGE_DAYS * 86400]:
+                del backlog_dropped[unique]
+            ordered = sorted(backlog.items(), key=lambda pair: pair[1]['priority'], reverse=True)
+
+        # Resolve the likely picks' Google News links together rather than one by one
+        # in the loop below
+        candidates = [item['link'] for _, item in ordered[:limit * len(CHANNELS)] if not item['posted']]
+        list(feed_executor.map(canonical_url, candidates))
+
+        for unique, item in ordered:
+            if len(counts) == len(CHANNELS) and all(count >= limit for count in counts.values()):
+                break
+            with backlog_lock:
+                if unique not in backlog:  # dropped or finished since the sort
+                    continue
+                channels = tuple(name for name in item['channels'] if counts.get(name, 0) < limit)
+            if not channels:
+                continue
+            # An item already posted to some channels would match its own story
+            if not item['posted']:
+                duplicate = find_near_duplicate(item['title'], item['link'])
+                if duplicate:
+                    with backlog_lock:
+                        backlog.pop(unique, None)
+                    mark_sent(unique)
+                    logging.info(f"Skipping duplicate '{item['title']}': {duplicate}")
+                    continue
+                remember_story(item['title'], item['link'])
+            with backlog_lock:
+                item['channels'] = [name for name in item['channels'] if name not in channels]
+                item['in_flight'] = item['in_flight'] + list(channels)
+                item['posted'] = True
+            for name in channels:
+                counts[name] = counts.get(name, 0) + 1
+            post = prepare_news_post(item['entry'], item['source'])
+            post['backlog_key'] = unique
+            picked.append((item['entry'], item['source'], post, channels))
+
+        save_backlog()
+        return picked, counts
+
+
+def backlog_delivered(post, name, ok):
+    # Send path callback: the item leaves the backlog (into sent_news) once every
+    # channel has it; a refused channel goes back to be picked next cycle
+    unique = post.get('backlog_key')
+    if unique is None:
+        return
+    with backlog_lock:
+        item = backlog.get(unique)
+        if item is not None:
+            if name in item['in_flight']:
+                item['in_flight'].remove(name)
+            if not ok:
+                item['channels'].append(name)
+            finished = not item['channels'] and not item['in_flight']
+            if finished:
+                del backlog[unique]
+    if not ok:
+        logging.warning(f"'{post['title']}' not posted to {name}, kept in backlog")
+    elif item is None or finished:
+        mark_sent(unique)
+    backlog_dirty.set()
+    mark_state_dirty()
+
+
+# ────────────────────────────────────────────────
+#                TELEGRAM DISPATCHER
+# ────────────────────────────────────────────────
+# Every outbound Telegram call goes through one thread, paced by token buckets.
+# Producers enqueue jobs with submit_telegram_job() and don't sleep themselves;
+# work that depends on slower futures (images) is queued with submit_when_done()
+# only once they finish, so the thread never waits on anything but Telegram.
+
+TELEGRAM_SEND_METHODS = {'send_message', 'send_photo', 'send_media_group', 'reply_to'}
+
+telegram_queue = queue.Queue()
+telegram_chat_buckets = {}
+telegram_global_bucket = {'tokens': TELEGRAM_GLOBAL_RATE, 'stamp': time.monotonic()}
+
+
+def take_token(bucket, rate, burst):
+    now = time.monotonic()
+    bucket['tokens'] = min(burst, bucket['tokens'] + (now - bucket['stamp']) * rate)
+    bucket['stamp'] = now
+    if bucket['tokens'] < 1:
+        time.sleep((1 - bucket['tokens']) / rate)
+        bucket['tokens'] = 1
+        bucket['stamp'] = time.monotonic()
+    bucket['tokens'] -= 1
+
+
+def request_chat_id(args, kwargs):
+    chat = kwargs.get('chat_id', args[0] if args else None)
+    if hasattr(chat, 'chat'):  # reply_to(message, ...)
+        chat = chat.chat.id
+    return chat
+
+
+def dispatch_telegram(method, args, kwargs):
+    # Runs on the dispatcher thread only, so the buckets need no lock
+    chat_id = request_chat_id(args, kwargs)
+    for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+        if method in TELEGRAM_SEND_METHODS:
+            bucket = telegram_chat_buckets.setdefault(chat_id, {'tokens': TELEGRAM_CHAT_BURST, 'stamp': time.monotonic()})
+            take_token(bucket, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+        take_token(telegram_global_bucket, TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+        try:
+            with timed('telegram_request_seconds', method=method):
+                result = getattr(bot, method)(*args, **kwargs)
+            inc_counter('telegram_requests_total', method=method, result='ok')
+            return result
+        except telebot.apihelper.ApiTelegramException as e:
+            inc_counter('telegram_requests_total', method=method, result=str(e.error_code))
+            if e.error_code != 429 or attempt == TELEGRAM_MAX_RETRIES:
+                raise
+            retry_after = ((e.result_json or {}).get('parameters') or {}).get('retry_after', 5)
+            logging.warning(f"Telegram 429 on {method}, retrying in {retry_after}s")
+            if chat_id in telegram_chat_buckets:
+                telegram_chat_buckets[chat_id]['tokens'] = 0
+            time.sleep(retry_after)
+
+
+def submit_telegram_job(fn, *args, **kwargs):
+    future = Future()
+    telegram_queue.put((future, fn, args, kwargs))
+    return future
+
+
+def submit_when_done(futures, fn, *args, **kwargs):
+    # Returns a Future for fn(*args, **kwargs), queued on the dispatcher once every
+    # future in `futures` (None entries are ignored) has finished
+    result = Future()
+    pending = [future for future in futures if future is not None]
+    remaining = [len(pending)]
+    remaining_lock = threading.Lock()
+
+    def relay(job):
+        if job.exception() is not None:
+            result.set_exception(job.exception())
         else:
-            bot.send_message(
-                chat_id=CHANNEL_ID,
-                text=caption,
-                parse_mode='MarkdownV2',
-                disable_web_page_preview=True
-            )
-        logging.info(f"Sent news: {title}")
-        return True
-
-    except telebot.apihelper.ApiTelegramException as e:
-        logging.error(f"Telegram error while sending: {e.description}")
-        fallback = (
-            f"📰 **{escape_md_v2(title)}**\n"
-            f"{escape_md_v2(desc_short)}\n\n"
-            f"{escape_md_v2(source_name)} • {escape_md_v2(published[:16])}\n"
-            f"{escape_md_v2(link)}"
-        )
+            result.set_result(job.result())
+
+    def finished(_):
+        with remaining_lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        submit_telegram_job(fn, *args, **kwargs).add_done_callback(relay)
+
+    if not pending:
+        submit_telegram_job(fn, *args, **kwargs).add_done_callback(relay)
+    for future in pending:
+        future.add_done_callback(finished)
+    return result
+
+
+def telegram_request(method, *args, **kwargs):
+    # Blocking call to bot.<method>, rate limited; safe to call from inside a job
+    if threading.current_thread() is telegram_thread:
+        return dispatch_telegram(method, args, kwargs)
+    return submit_telegram_job(dispatch_telegram, method, args, kwargs).result()
+
+
+def telegram_dispatcher():
+    while True:
+        future, fn, args, kwargs = telegram_queue.get()
+        if not future.set_running_or_notify_cancel():
+            continue
         try:
-            bot.send_message(
-                CHANNEL_ID,
-                fallback,
-                parse_mode='MarkdownV2',
-                disable_web_page_preview=True
-            )
-        except Exception as fallback_e:
-            logging.error(f"Fallback also failed: {fallback_e}")
-        return True
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+
+
+telegram_thread = threading.Thread(target=telegram_dispatcher, daemon=True, name='telegram')
 
+
+def remember_file_id(image_hash, msg):
+    if msg is None or not getattr(msg, 'photo', None):
+        return
+    with photo_file_ids_lock:
+        photo_file_ids[image_hash] = msg.photo[-1].file_id
+        while len(photo_file_ids) > PHOTO_FILE_IDS_MAX:
+            del photo_file_ids[next(iter(photo_file_ids))]
+
+
+def send_photo_bytes(chat_id, image_bytes, **kwargs):
+    # Sends by file_id when the same image was uploaded before, so repeated
+    # images (publisher logos, generic thumbnails) cost no upload
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    with photo_file_ids_lock:
+        file_id = photo_file_ids.get(image_hash)
+
+    inc_counter('photo_file_id_total', result='hit' if file_id else 'miss')
+    if file_id:
+        try:
+            return telegram_request('send_photo', chat_id=chat_id, photo=file_id, **kwargs)
+        except telebot.apihelper.ApiTelegramException as e:
+            if 'file' not in (e.description or '').lower():
+                raise
+            logging.info(f"Cached file_id rejected, uploading again: {e.description}")
+            with photo_file_ids_lock:
+                photo_file_ids.pop(image_hash, None)
+
+    photo = io.BytesIO(image_bytes)
+    photo.name = 'news.jpg'
+    msg = telegram_request('send_photo', chat_id=chat_id, photo=photo, **kwargs)
+    inc_counter('telegram_upload_bytes_total', len(image_bytes))
+    remember_file_id(image_hash, msg)
+    mark_state_dirty()
+    return msg
+
+
+def post_image_bytes(entry, post):
+    if post['image'] is None:
+        return acquire_news_image(entry, post)
+    try:
+        return post['image'].result()
     except Exception as e:
-        logging.error(f"Critical error sending news '{title}': {e}")
-        return False
+        logging.error(f"Image preparation failed for '{post['title']}': {e}")
+        return None
 
 
-def send_or_update_notification(text):
-    global last_notification_message_id
+def send_news_album(items, name):
+    # items: [(entry, source_name, post)] for one channel. Everything with an image
+    # goes into one album; the rest, or everything if the album is refused, is
+    # posted item by item.
+    chat_id = CHANNELS_BY_NAME[name]['chat_id']
+    photos = []
+    singles = []
+    for entry, source_name, post in items:
+        image_bytes = post_image_bytes(entry, post)
+        if image_bytes and len(photos) < ALBUM_MAX_ITEMS:
+            photos.append((entry, source_name, post, image_bytes))
+        else:
+            singles.append((entry, source_name, post))
+
+    if len(photos) < 2:
+        singles = [(entry, source_name, post) for entry, source_name, post, _ in photos] + singles
+        photos = []
+
+    if photos:
+        media = []
+        uploads = {}  # position in album -> hash of the bytes uploaded there
+        for i, (_, _, post, image_bytes) in enumerate(photos):
+            image_hash = hashlib.sha256(image_bytes).hexdigest()
+            with photo_file_ids_lock:
+                file_id = photo_file_ids.get(image_hash)
+            if file_id is None:
+                uploads[i] = image_hash
+            inc_counter('photo_file_id_total', result='hit' if file_id else 'miss')
+            media.append(InputMediaPhoto(file_id or image_bytes, caption=post['caption'], parse_mode='MarkdownV2'))
+        try:
+            msgs = telegram_request('send_media_group', chat_id, media)
+            inc_counter('telegram_upload_bytes_total', sum(len(photos[i][3]) for i in uploads))
+            for i, image_hash in uploads.items():
+                if msgs and i < len(msgs):
+                    remember_file_id(image_hash, msgs[i])
+            mark_state_dirty()
+            inc_counter('album_items_total', len(photos))
+            for _, _, post, _ in photos:
+                logging.info(f"Sent news to {name} (album): {post['title']}")
+                backlog_delivered(post, name, True)
+        except Exception as e:
+            logging.error(f"Album of {len(photos)} failed in {name}, posting one by one: {e}")
+            singles = [(entry, source_name, post) for entry, source_name, post, _ in photos] + singles
+
+    for entry, source_name, post in singles:
+        send_news_photo(entry, source_name, post, (name,))
+
+
+def submit_news_posts(items):
+    # items: [(entry, source_name, post, channel names)] in posting order. Each send
+    # is queued once its images are ready. Returns {channel: [send futures]}.
+    jobs = {}
+    if not ALBUM_MODE:
+        for entry, source_name, post, channels in items:
+            job = submit_when_done([post['image']], send_news_photo, entry, source_name, post, channels)
+            for name in channels:
+                jobs.setdefault(name, []).append(job)
+        return jobs
+    per_channel = {}
+    for entry, source_name, post, channels in items:
+        for name in channels:
+            per_channel.setdefault(name, []).append((entry, source_name, post))
+    for name, channel_items in per_channel.items():
+        images = [post['image'] for _, _, post in channel_items]
+        jobs[name] = [submit_when_done(images, send_news_album, channel_items, name)]
+    return jobs
+
+
+def send_news_photo(entry, source_name, post=None, channels=None):
+    # Posts one item to each of the given channels (all of them by default). The
+    # image is acquired once; channels after the first reuse its file_id.
+    if post is None:
+        post = build_news_post(entry, source_name)
+    title = post['title']
+    link = post['link']
+    published = post['published']
+    desc_short = post['desc_short']
+    caption = post['caption']
+
+    image_bytes = post_image_bytes(entry, post)
+
+    sent = False
+    for name in channels or CHANNELS_BY_NAME:
+        chat_id = CHANNELS_BY_NAME[name]['chat_id']
+        delivered = False
+        try:
+            if image_bytes:
+                send_photo_bytes(
+                    chat_id,
+                    image_bytes,
+                    caption=caption,
+                    parse_mode='MarkdownV2'
+                )
+            else:
+                telegram_request(
+                    'send_message',
+                    chat_id=chat_id,
+                    text=caption,
+                    parse_mode='MarkdownV2',
+                    disable_web_page_preview=True
+                )
+            logging.info(f"Sent news to {name}: {title}")
+            delivered = True
+
+        except telebot.apihelper.ApiTelegramException as e:
+            logging.error(f"Telegram error while sending to {name}: {e.description}")
+            fallback = (
+                f"📰 **{escape_md_v2(title)}**\n"
+                f"{escape_md_v2(desc_short)}\n\n"
+                f"{escape_md_v2(source_name)} • {escape_md_v2(published[:16])}\n"
+                f"{escape_md_v2(link)}"
+            )
+            try:
+                telegram_request(
+                    'send_message',
+                    chat_id,
+                    fallback,
+                    parse_mode='MarkdownV2',
+                    disable_web_page_preview=True
+                )
+                delivered = True
+            except Exception as fallback_e:
+                logging.error(f"Fallback also failed: {fallback_e}")
 
-    if last_notification_message_id is not None:
+        except Exception as e:
+            logging.error(f"Critical error sending news '{title}' to {name}: {e}")
+        backlog_delivered(post, name, delivered)
+        sent = sent or delivered
+    return sent
+
+
+def send_or_update_notification(text, name=None):
+    name = name or CHANNELS[0]['name']
+    chat_id = CHANNELS_BY_NAME[name]['chat_id']
+    previous_id = last_notification_ids.get(name)
+
+    if previous_id is not None:
         try:
-            bot.delete_message(CHANNEL_ID, last_notification_message_id)
-            logging.info(f"Deleted old notification #{last_notification_message_id}")
+            telegram_request('delete_message', chat_id, previous_id)
+            logging.info(f"Deleted old notification #{previous_id} in {name}")
         except Exception as e:
             logging.info(f"Could not delete old notification (possibly already deleted): {e}")
 
     try:
-        msg = bot.send_message(
-            CHANNEL_ID,
+        msg = telegram_request(
+            'send_message',
+            chat_id,
             text,
             disable_web_page_preview=True
         )
-        last_notification_message_id = msg.message_id
-        save_last_notification_id()
-        logging.info(f"New notification: {text}  (id={msg.message_id})")
+        last_notification_ids[name] = msg.message_id
+        mark_state_dirty()
+        logging.info(f"New notification in {name}: {text}  (id={msg.message_id})")
     except Exception as e:
-        logging.error(f"Failed to send notification '{text}': {e}")
+        logging.error(f"Failed to send notification '{text}' to {name}: {e}")
+
+
+def note_feed_order(url, pub_ts, last_ts):
+    # Returns the timestamp to compare the next item with
+    if pub_ts is None:
+        return last_ts
+    if last_ts is not None and pub_ts > last_ts and url not in unordered_feeds:
+        logging.info(f"Items of {url} are not in date order, reading it in full")
+        unordered_feeds.add(url)
+        mark_state_dirty()
+    return pub_ts
 
 
 def send_recent_news(initial_run=False):
-    total_sent = 0
     max_send = 4 if initial_run else 5
 
-    for source_name, url in RSS_FEEDS:
-        content = fetch_feed(url)
+    for source_name, url, content in fetch_feeds(RSS_FEEDS):
         if not content:
             continue
-        feed = feedparser.parse(content)
-        if not feed.entries:
-            continue
 
-        for entry in feed.entries:
-            title_lower = (entry.get('title') or '').strip().lower()
-            desc_lower = (entry.get('description') or entry.get('summary') or '').strip().lower()
+        known_run = 0
+        last_ts = None
+        for entry in parse_feed_entries(content, source_name):
+            title = (entry.get('title') or '').strip()
+            desc = (entry.get('description') or entry.get('summary') or '').strip()
             link = entry.get('link', '')
-            unique_key = f"{title_lower}_{link[:120]}"
-
-            if unique_key in sent_news:
+            unique_key = f"{title.lower()}_{link[:120]}"
+            pub_parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+            pub_ts = calendar.timegm(pub_parsed) if pub_parsed else None
+            last_ts = note_feed_order(url, pub_ts, last_ts)
+
+            if is_known(unique_key):
+                known_run += 1
+                if known_run >= INCREMENTAL_STOP_AFTER_KNOWN and url not in unordered_feeds:
+                    break
                 continue
+            known_run = 0
+
+            channels, hits = route_entry(f"{title}\n{clean_html(desc)}")
+            if channels:
+                # Cheap check while queueing; the backlog checks again, with
+                # Google News links resolved, only for items it picks
+                duplicate = find_near_duplicate(title, link, lookup=False)
+                if duplicate:
+                    mark_sent(unique_key)
+                    logging.info(f"Skipping duplicate '{title}': {duplicate}")
+                    continue
+                enqueue_backlog(unique_key, entry, source_name, channels, hits, pub_ts)
+                add_daily_news(title, source_name, desc, channels)
 
-            if any(kw.lower() in title_lower or kw.lower() in desc_lower for kw in KEYWORDS):
-                sent_news.add(unique_key)
-                daily_news.append({
-                    'title': entry.get('title', '').strip(),
-                    'desc': (entry.get('description') or entry.get('summary', '')).strip(),
-                    'source': source_name,
-                    'pub_date': entry.get('published') or entry.get('updated', '')
-                })
-
-                if send_news_photo(entry, source_name):
-                    total_sent += 1
-                    save_sent_news()
-                time.sleep(random.uniform(4.5, 8.0))
-
-                if total_sent >= max_send and initial_run:
-                    return
+    queued, _ = drain_backlog(max_send)
+    submit_news_posts(queued)
 
 
-def send_and_pin_summary(slot):
-    global LAST_PINNED_SUMMARY_ID
-    
-    slot_titles = {
-        'morning': 'Morning Briefing',
-        'noon': 'Midday Update',
-        'evening': 'Evening Recap',
-        'manual': 'Manual Summary'
-    }
-    slot_title = slot_titles.get(slot, 'Daily Summary')
-    today_str = datetime.date.today().strftime("%B %d, %Y")
+def get_groq_client():
+    global groq_client
+    with groq_client_lock:
+        if groq_client is None:
+            from groq import Groq
+            groq_client = Groq(api_key=GROQ_API_KEY)
+    return groq_client
 
-    if not daily_news:
-        text = f"📊 {slot_title} ({today_str})\n\nNo significant news during this period."
-    else:
-        news_block = ""
-        for item in daily_news[-20:]:
-            news_block += f"[{item['source']}] {item['title']}\n"
 
-        prompt = f"""You are a concise global markets analyst. Write a very short recap — 2 to 4 bullet points maximum.
+def summary_prompt(today_str, news_block):
+    return f"""You are a concise global markets analyst. Write a very short recap — 2 to 4 bullet points maximum.
 Focus exclusively on the MOST important market-moving events/trends from TODAY's news only.
 Start directly with bullets. No introductions, no commentary, no extra text.
 Use this exact format for each line:
@@ -448,24 +2411,135 @@ Date: {today_str}
 News headlines:
 {news_block}"""
 
-        try:
-            resp = groq_client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=180,
-                temperature=0.65,
-            )
-            summary_text = resp.choices[0].message.content.strip()
 
+def batch_prompt(news_block):
+    return f"""Condense these news headlines into at most 3 short bullet notes covering only the
+market-moving facts. Keep numbers and names. No introductions, bullets only.
+{news_block}"""
+
+
+def cached_completion(prompt, max_tokens):
+    key = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    with summary_lock:
+        cached = summary_cache.get(key)
+    inc_counter('summary_cache_total', result='hit' if cached else 'miss')
+    if cached:
+        return cached
+
+    with timed('groq_summary_seconds'):
+        resp = get_groq_client().chat.completions.create(
+            model="llama-3.3-70b-versatile",
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=0.65,
+        )
+    text = resp.choices[0].message.content.strip()
+    with summary_lock:
+        summary_cache[key] = text
+        while len(summary_cache) > SUMMARY_CACHE_MAX:
+            del summary_cache[next(iter(summary_cache))]
+    return text
+
+
+def build_summary(records, today_str):
+    # Batches are cut from the start of the list, so as news is appended only the
+    # last batch and the final merge change; everything else comes from the cache
+    batches = [records[i:i + SUMMARY_BATCH_SIZE] for i in range(0, len(records), SUMMARY_BATCH_SIZE)]
+    batches = batches[-SUMMARY_MAX_BATCHES:]
+    blocks = [''.join(f"[{item.source}] {item.title}\n" for item in batch) for batch in batches]
+    if len(blocks) == 1:
+        news_block = blocks[0]
+    else:
+        news_block = '\n'.join(cached_completion(batch_prompt(block), 150) for block in blocks) + '\n'
+    return cached_completion(summary_prompt(today_str, news_block), 180)
+
+
+def refresh_rolling_summary(name):
+    with summary_lock:
+        mark = summary_marks.get(name, 0)
+    records = channel_daily_news(name)
+    if not records:
+        return None
+    key = (len(records), records[-1].ts, datetime.date.today().isoformat())
+    with summary_lock:
+        current = rolling_summaries.get(name)
+    if current and current['key'] == key:
+        return current
+
+    today_str = datetime.date.today().strftime("%B %d, %Y")
+    with timed('summary_refresh_seconds'):
+        text = build_summary(records, today_str)
+    current = {'text': text, 'key': key, 'last_ts': records[-1].ts, 'built_at': time.time()}
+    with summary_lock:
+        if summary_marks.get(name, 0) != mark:
+            # A summary went out while this was building; it covers published news
+            logging.info(f"Discarding rolling summary for {name}, watermark moved")
+            return None
+        rolling_summaries[name] = current
+        last_good_summaries[name] = {'text': text, 'built_at': current['built_at']}
+    mark_state_dirty()
+    logging.info(f"Rolling summary for {name} updated ({len(records)} items)")
+    return current
+
+
+def summary_builder():
+    while True:
+        summary_dirty.wait()
+        time.sleep(SUMMARY_REFRESH_DELAY)
+        summary_dirty.clear()
+        for channel in CHANNELS:
+            try:
+                refresh_rolling_summary(channel['name'])
+            except Exception as e:
+                logging.warning(f"Rolling summary for {channel['name']} failed: {e}")
+
+
+def send_and_pin_summary(slot, name=None):
+    name = name or CHANNELS[0]['name']
+    chat_id = CHANNELS_BY_NAME[name]['chat_id']
+
+    slot_titles = {
+        'morning': 'Morning Briefing',
+        'noon': 'Midday Update',
+        'evening': 'Evening Recap',
+        'manual': 'Manual Summary'
+    }
+    slot_title = slot_titles.get(slot, 'Daily Summary')
+    today_str = datetime.date.today().strftime("%B %d, %Y")
+
+    records = channel_daily_news(name)
+    summarized_until = None
+    if not records:
+        text = f"📊 {slot_title} ({today_str})\n\nNo significant news during this period."
+    else:
+        # Normally the background builder has this ready; build inline only if it hasn't run yet
+        with summary_lock:
+            current = rolling_summaries.get(name)
+        if current is None:
+            try:
+                current = refresh_rolling_summary(name)
+            except Exception as e:
+                logging.error(f"Error generating summary ({slot}, {name}): {e}")
+
+        if current is not None:
+            summarized_until = current['last_ts']
             # Use the model's bullet points directly (most reliable when prompt asks for them)
             text = (
                 f"📊 {slot_title} ({today_str}) — Key market-moving events:\n"
                 f"\n"
-                f"{summary_text}"
+                f"{current['text']}"
             )
-
-        except Exception as e:
-            logging.error(f"Error generating summary ({slot}): {e}")
+        elif name in last_good_summaries:
+            last_good = last_good_summaries[name]
+            built_at = datetime.datetime.fromtimestamp(last_good['built_at'])
+            text = (
+                f"📊 {slot_title} ({today_str}) — Key market-moving events:\n"
+                f"\n"
+                f"{last_good['text']}\n"
+                f"\n"
+                f"⚠️ Latest update unavailable, summary from {built_at:%b %d %H:%M}"
+            )
+        else:
             text = (
                 f"📊 {slot_title} ({today_str})\n"
                 f"\n"
@@ -473,191 +2547,503 @@ News headlines:
             )
 
     # ─── Pinning logic ───
-    if LAST_PINNED_SUMMARY_ID is not None:
+    pinned_id = last_pinned_summary_ids.get(name)
+    if pinned_id is not None:
         try:
-            bot.unpin_chat_message(CHANNEL_ID, LAST_PINNED_SUMMARY_ID)
-            logging.info(f"Unpinned old summary #{LAST_PINNED_SUMMARY_ID}")
+            telegram_request('unpin_chat_message', chat_id, pinned_id)
+            logging.info(f"Unpinned old summary #{pinned_id} in {name}")
         except Exception as e:
             logging.info(f"Could not unpin old message (maybe already unpinned or deleted): {e}")
 
     try:
-        msg = bot.send_message(
-            chat_id=CHANNEL_ID,
+        msg = telegram_request(
+            'send_message',
+            chat_id=chat_id,
             text=text,
             parse_mode="Markdown",
             disable_web_page_preview=True
         )
         new_message_id = msg.message_id
 
-        bot.pin_chat_message(
-            chat_id=CHANNEL_ID,
+        telegram_request(
+            'pin_chat_message',
+            chat_id=chat_id,
             message_id=new_message_id,
             disable_notification=True
         )
-        logging.info(f"Pinned new summary #{new_message_id}")
+        logging.info(f"Pinned new summary #{new_message_id} in {name}")
 
-        LAST_PINNED_SUMMARY_ID = new_message_id
-        save_last_pinned_id()
+        last_pinned_summary_ids[name] = new_message_id
+        mark_state_dirty()
 
     except Exception as e:
         logging.error(f"Failed to send/pin summary: {e}")
         fallback_text = text + "\n\n*(не удалось закрепить сообщение)*"
-        bot.send_message(
-            chat_id=CHANNEL_ID,
+        telegram_request(
+            'send_message',
+            chat_id=chat_id,
             text=fallback_text,
             parse_mode="Markdown",
             disable_web_page_preview=True
         )
 
-    # Clear news after successful processing
-    if daily_news:
-        daily_news.clear()
+    # Move the watermark only up to what the posted text covered; a fallback
+    # (last good summary or error notice) covers none of these records
+    if summarized_until is not None:
+        clear_daily_news(name, summarized_until)
         
+def run_check_cycle(feeds=None):
+    # Polls the given feeds (all of them by default); background_checker passes
+    # only the ones that are due
+    cycle_start = time.perf_counter()
+    matched = 0
+
+    for source_name, url, content in fetch_feeds(RSS_FEEDS if feeds is None else feeds):
+        timestamps = []
+        if not content:
+            reschedule_feed(url, content, timestamps, time.time())
+            continue
+
+        # In a newest-first feed, once we hit a run of items that are already
+        # sent or outside the window, the rest of the document is not parsed
+        window_start = feed_last_check(url) - 90 * 60
+        known_run = 0
+        last_ts = None
+        for entry in islice(parse_feed_entries(content, source_name), 30):
+            title = (entry.get('title') or '').strip()
+            desc = (entry.get('description') or entry.get('summary') or '').strip()
+            link = entry.get('link', '')
+            unique = f"{title.lower()}_{link[:120]}"
+
+            pub_ts = None
+            pub_parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+            if pub_parsed:
+                pub_ts = calendar.timegm(pub_parsed)
+                timestamps.append(pub_ts)
+            last_ts = note_feed_order(url, pub_ts, last_ts)
+
+            seen = is_known(unique) or (pub_ts is not None and pub_ts < window_start)
+            if seen:
+                known_run += 1
+                if known_run >= INCREMENTAL_STOP_AFTER_KNOWN and url not in unordered_feeds:
+                    break
+                continue
+            known_run = 0
+
+            channels, hits = route_entry(f"{title}\n{clean_html(desc)}")
+            if channels:
+                logging.debug(f"Matched {sorted(hits)} for {', '.join(channels)}: {title}")
+                # Cheap check while queueing; the backlog checks again, with
+                # Google News links resolved, only for items it picks
+                duplicate = find_near_duplicate(title, link, lookup=False)
+                if duplicate:
+                    mark_sent(unique)
+                    logging.info(f"Skipping duplicate '{title}': {duplicate}")
+                    continue
+                enqueue_backlog(unique, entry, source_name, channels, hits, pub_ts)
+                add_daily_news(title, source_name, desc, channels)
+                matched += 1
+
+        reschedule_feed(url, content, timestamps, time.time())
+
+    # Whatever is best in the backlog goes out, including items left over from
+    # earlier cycles
+    queued, posted = drain_backlog()
+    maybe_compact_sent_news()
+
+    if queued:
+        logging.info(f"Found {matched} new news items, posting {len(queued)}, {len(backlog)} left in backlog")
+        jobs = submit_news_posts(queued)
+        for name, count in posted.items():
+            submit_when_done(jobs.get(name, []), send_or_update_notification,
+                             f"Posted {count} fresh news item{'s' if count != 1 else ''} 📈", name)
+    else:
+        logging.info("No new matching news found")
+    inc_counter('news_matched_total', matched)
+    observe('check_cycle_seconds', time.perf_counter() - cycle_start)
+    return sum(posted.values())
+
+
 def background_checker():
-    global last_check_time
+    while True:
+        time.sleep(max(next_feed_due() - time.time(), 1))
+        feeds = due_feeds(time.time())
+        if not feeds:
+            continue
+        logging.info(f"Background check started: {', '.join(name for name, _ in feeds)}")
+        try:
+            profile_chat = take_profiled_cycle()
+            if profile_chat is None:
+                run_check_cycle(feeds)
+            else:
+                profiled = run_profiled('cycle', run_check_cycle, feeds)
+                if profiled is None:
+                    # Busy with another profile: run this cycle plainly, profile a later one
+                    with profile_lock:
+                        profile_state['cycles'] += 1
+                    run_check_cycle(feeds)
+                else:
+                    _, path, report = profiled
+                    logging.info(f"Profiled background cycle -> {path}")
+                    send_profile_report(profile_chat, 'background cycle', path, report)
+        except Exception as e:
+            logging.error(f"Background check failed: {e}")
+
+
+# ────────────────────────────────────────────────
+#                SUMMARY SCHEDULER
+# ────────────────────────────────────────────────
+
+def parse_summary_slots(spec):
+    # "morning=07:30,noon=12:45" -> [('morning', 7, 30), ('noon', 12, 45)]
+    slots = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            name, hhmm = part.split('=', 1)
+            hour, minute = (int(x) for x in hhmm.split(':', 1))
+            if not (0 <= hour < 24 and 0 <= minute < 60):
+                raise ValueError(hhmm)
+        except ValueError:
+            logging.error(f"Ignoring invalid summary slot '{part}'")
+            continue
+        slots.append((name.strip(), hour, minute))
+    return slots
+
+
+def slot_time(tz, day, hour, minute):
+    return tz.localize(datetime.datetime.combine(day, datetime.time(hour, minute)))
 
-    NEGATIVE_KEYWORDS = [
-        'stepmother', 'estate', 'robbery', 'war in ukraine',
-        'divorce', 'cheated', 'tennis', 'fiancee', 'married','hair',
-        'brother',
+
+def next_fire_time(tz, now, hour, minute):
+    fire_at = slot_time(tz, now.date(), hour, minute)
+    if fire_at <= now:
+        fire_at = slot_time(tz, now.date() + datetime.timedelta(days=1), hour, minute)
+    return fire_at
+
+
+def previous_fire_time(tz, now, hour, minute):
+    fire_at = slot_time(tz, now.date(), hour, minute)
+    if fire_at > now:
+        fire_at = slot_time(tz, now.date() - datetime.timedelta(days=1), hour, minute)
+    return fire_at
+
+
+def channel_summary_slots():
+    # [(channel name, slot name, hour, minute)] across all channels
+    return [
+        (channel['name'], *slot)
+        for channel in CHANNELS
+        for slot in parse_summary_slots(channel['summary_slots'])
     ]
 
+
+def run_summary_slot(channel, name, day):
+    sent = last_sent_summaries.setdefault(channel, {})
+    if sent.get(name) == str(day):
+        return
+    logging.info(f"Starting {name} summary for {channel} on {day}")
+    send_and_pin_summary(name, channel)
+    sent[name] = str(day)
+    save_state()
+
+
+def catch_up_missed_summary(tz, slots):
+    # After a restart, post each channel's most recent slot that was missed within
+    # the grace period. Older missed slots are skipped: their news is already part of this one.
+    now = datetime.datetime.now(tz)
+    grace = datetime.timedelta(minutes=SUMMARY_CATCHUP_GRACE_MINUTES)
+    missed = {}
+    for channel, name, hour, minute in slots:
+        fired_at = previous_fire_time(tz, now, hour, minute)
+        if now - fired_at <= grace and last_sent_summaries.get(channel, {}).get(name) != str(fired_at.date()):
+            missed[channel] = max(missed.get(channel, (fired_at, name)), (fired_at, name))
+    for channel, (fired_at, name) in missed.items():
+        logging.info(f"Catching up missed {name} summary for {channel} (was due {fired_at:%H:%M})")
+        run_summary_slot(channel, name, fired_at.date())
+
+
+def summary_scheduler():
+    tz = pytz.timezone(SUMMARY_TIMEZONE)
+    slots = channel_summary_slots()
+    if not slots:
+        logging.warning("No summary slots configured, scheduler stopped")
+        return
+
+    catch_up_missed_summary(tz, slots)
+
     while True:
-        logging.info("Background check started")
-        time.sleep(random.randint(120, 300))
+        now = datetime.datetime.now(tz)
+        fire_at = min(next_fire_time(tz, now, hour, minute) for _, _, hour, minute in slots)
+        due = [(channel, name) for channel, name, hour, minute in slots
+               if next_fire_time(tz, now, hour, minute) == fire_at]
+        logging.info(f"Next summary: {', '.join(f'{name} for {channel}' for channel, name in due)} at {fire_at:%Y-%m-%d %H:%M %Z}")
 
-        now = datetime.datetime.now(datetime.timezone.utc)
-        new_news = []
+        # Sleep in chunks of at most an hour so a wall-clock jump can't push the slot far off
+        while True:
+            remaining = (fire_at - datetime.datetime.now(tz)).total_seconds()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 3600))
 
-        for source_name, url in RSS_FEEDS:
-            content = fetch_feed(url)
-            if not content:
-                continue
-            feed = feedparser.parse(content)
+        for channel, name in due:
+            try:
+                run_summary_slot(channel, name, fire_at.date())
+            except Exception as e:
+                logging.error(f"Summary slot {name} for {channel} failed: {e}")
 
-            for entry in feed.entries[:30]:
-                title_lower = (entry.get('title') or '').strip().lower()
-                desc_lower = (entry.get('description') or entry.get('summary') or '').strip().lower()
-                link = entry.get('link', '')
-                unique = f"{title_lower}_{link[:120]}"
 
-                if unique in sent_news:
-                    continue
+# ────────────────────────────────────────────────
+#                COMMAND HANDLERS
+# ────────────────────────────────────────────────
 
-                pub_parsed = entry.get('published_parsed') or entry.get('updated_parsed')
-                if pub_parsed:
-                    pub_time = datetime.datetime(*pub_parsed[:6], tzinfo=datetime.timezone.utc)
-                    if pub_time < last_check_time - datetime.timedelta(minutes=90):
-                        continue
+@bot.message_handler(commands=['summary'])
+def manual_summary(message):
+    # /summary posts to every channel, /summary <channel name> to one
+    if message.chat.type == 'private':
+        args = (message.text or '').split()[1:]
+        names = [args[0]] if args else list(CHANNELS_BY_NAME)
+        if names[0] not in CHANNELS_BY_NAME:
+            telegram_request('reply_to', message, f"Unknown channel. Channels: {', '.join(CHANNELS_BY_NAME)}")
+            return
+        for name in names:
+            send_and_pin_summary('manual', name)
+        telegram_request('reply_to', message, f"Summary posted and pinned to {', '.join(names)}")
+    else:
+        telegram_request('reply_to', message, "The /summary command works only in private messages")
 
-                has_positive = any(kw.lower() in title_lower or kw.lower() in desc_lower for kw in KEYWORDS)
-                has_negative = any(neg.lower() in title_lower or neg.lower() in desc_lower for neg in NEGATIVE_KEYWORDS)
-
-                if has_positive and not has_negative:
-                    sent_news.add(unique)
-                    daily_news.append({
-                        'title': entry.get('title', '').strip(),
-                        'desc': (entry.get('description') or entry.get('summary', '')).strip(),
-                        'source': source_name,
-                        'pub_date': entry.get('published') or entry.get('updated', '')
-                    })
-                    new_news.append((entry, source_name))
-
-        last_check_time = now
-
-        if new_news:
-            logging.info(f"Found {len(new_news)} new news items")
-            for entry, source in new_news[:4]:
-                send_news_photo(entry, source)
-                time.sleep(random.uniform(6, 11))
-            save_sent_news()
-            count = min(4, len(new_news))
-            send_or_update_notification(f"Posted {count} fresh news item{'s' if count != 1 else ''} 📈")
-        else:
-            logging.info("No new matching news found")
+
+@bot.message_handler(commands=['stats'])
+def show_stats(message):
+    if message.chat.type == 'private':
+        telegram_request('reply_to', message, format_stats())
+    else:
+        telegram_request('reply_to', message, "The /stats command works only in private messages")
+
+
+@bot.message_handler(commands=['profile'])
+def profile_command(message):
+    # /profile [N]     - profile the next N background cycles (default 1)
+    # /profile summary - profile one send_and_pin_summary('manual') now
+    if message.chat.type != 'private':
+        telegram_request('reply_to', message, "The /profile command works only in private messages")
+        return
+
+    args = (message.text or '').split()[1:]
+    if args and args[0].lower() == 'summary':
+        profiled = run_profiled('summary', send_and_pin_summary, 'manual')
+        if profiled is None:
+            telegram_request('reply_to', message, "Profiling busy, try again when the current run finishes")
+            return
+        _, path, report = profiled
+        send_profile_report(message.chat.id, 'summary', path, report)
+        return
+
+    try:
+        cycles = max(1, min(int(args[0]), 10)) if args else 1
+    except ValueError:
+        telegram_request('reply_to', message, "Usage: /profile [cycles] or /profile summary")
+        return
+    with profile_lock:
+        profile_state['cycles'] = cycles
+        profile_state['chat_id'] = message.chat.id
+    telegram_request('reply_to', message, f"Profiling the next {cycles} background cycle{'s' if cycles != 1 else ''}")
 
 
 # ────────────────────────────────────────────────
-#                SUMMARY SCHEDULER ← ИСПРАВЛЕНО!
+#                WEBHOOK
 # ────────────────────────────────────────────────
 
-def summary_scheduler():
-    tz = pytz.timezone('Asia/Bangkok')
+webhook_executor = ThreadPoolExecutor(max_workers=WEBHOOK_WORKERS, thread_name_prefix='webhook')
+webhook_slots = threading.BoundedSemaphore(WEBHOOK_MAX_PENDING)
+webhook_seen_ids = deque(maxlen=1000)  # Telegram redelivers an update if the 200 came too late
+webhook_seen_lock = threading.Lock()
 
-    while True:
-        now = datetime.datetime.now(tz)
-        today = now.date()
-
-        # УТРО 7:30
-        if now.hour == 7 and now.minute == 30 and now.second < 30:
-            if last_sent_summaries['morning'] != str(today):
-                logging.info("Starting morning summary at 7:30")
-                send_and_pin_summary('morning')
-                last_sent_summaries['morning'] = str(today)
-                save_last_sent_summaries()
-
-        # ДЕНЬ 12:45
-        if now.hour == 12 and now.minute == 45 and now.second < 30:
-            if last_sent_summaries['noon'] != str(today):
-                logging.info("Starting midday summary at 12:45")
-                send_and_pin_summary('noon')
-                last_sent_summaries['noon'] = str(today)
-                save_last_sent_summaries()
-
-        # ВЕЧЕР 20:00
-        if now.hour == 20 and now.minute == 0 and now.second < 30:
-            if last_sent_summaries['evening'] != str(today):
-                logging.info("Starting evening summary at 20:00")
-                send_and_pin_summary('evening')
-                last_sent_summaries['evening'] = str(today)
-                save_last_sent_summaries()
-
-        # Проверяем каждые 20–25 секунд — теперь точно не пропустим!
-        time.sleep(20 + random.uniform(0, 5))
+
+def process_webhook_update(update):
+    # bot is unthreaded in webhook mode, so the handler has finished by the time
+    # the slot is released
+    try:
+        with timed('webhook_update_seconds'):
+            bot.process_new_updates([update])
+    except Exception as e:
+        logging.error(f"Failed to process update {update.update_id}: {e}")
+    finally:
+        webhook_slots.release()
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path.split('?', 1)[0] != WEBHOOK_PATH:
+            self.send_error(404)
+            return
+        secret = self.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+            inc_counter('webhook_requests_total', result='forbidden')
+            self.send_error(403)
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > WEBHOOK_MAX_BODY:
+            inc_counter('webhook_requests_total', result='too_large')
+            self.send_error(413)
+            return
+        try:
+            update = telebot.types.Update.de_json(self.rfile.read(length).decode('utf-8'))
+        except Exception as e:
+            logging.warning(f"Bad webhook payload: {e}")
+            inc_counter('webhook_requests_total', result='bad_request')
+            self.send_error(400)
+            return
+
+        with webhook_seen_lock:
+            duplicate = update.update_id in webhook_seen_ids
+            if not duplicate:
+                webhook_seen_ids.append(update.update_id)
+        if duplicate:
+            inc_counter('webhook_requests_total', result='duplicate')
+        elif webhook_slots.acquire(blocking=False):
+            webhook_executor.submit(process_webhook_update, update)
+            inc_counter('webhook_requests_total', result='accepted')
+        else:
+            with webhook_seen_lock:
+                webhook_seen_ids.remove(update.update_id)
+            inc_counter('webhook_requests_total', result='busy')
+            self.send_error(503)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 64  # Telegram opens up to max_connections at once
+
+
+def run_webhook():
+    server = WebhookServer((WEBHOOK_HOST, WEBHOOK_PORT), WebhookHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='webhook').start()
+    try:
+        telegram_request(
+            'set_webhook',
+            url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_WORKERS,
+            allowed_updates=['message'],
+        )
+        logging.info(f"Webhook set to {WEBHOOK_URL}, listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    except Exception as e:
+        logging.error(f"Failed to set webhook: {e}")
+    shutdown_event.wait()
+    server.shutdown()
 
 
 # ────────────────────────────────────────────────
 #                STARTUP
 # ────────────────────────────────────────────────
 
-load_sent_news()
-load_last_notification_id()
-load_last_sent_summaries()
-load_last_pinned_id()
+def announce_start():
+    global last_started_at
+    now = time.time()
+    previous, last_started_at = last_started_at, now
+    save_state()
+    if previous and now - previous < STARTUP_MESSAGE_MIN_INTERVAL_HOURS * 3600:
+        logging.info(f"Warm restart ({int(now - previous)}s since last start), skipping test message")
+        return
+    for channel in CHANNELS:
+        try:
+            telegram_request(
+                'send_message',
+                channel['chat_id'],
+                "Bot started and ready to post news about major companies & markets\n"
+                "If you see this message — everything is working."
+            )
+            print(f"Test message sent to {channel['name']}")
+            logging.info(f"Test message sent to {channel['name']}")
+        except Exception as e:
+            print(f"ERROR sending test message to {channel['name']}: {e}")
+            logging.error(f"Test message not sent to {channel['name']}: {e}")
 
-print(f"Bot started → posting to channel {CHANNEL_ID}")
-logging.info(f"Bot started → channel {CHANNEL_ID}")
 
-try:
-    bot.send_message(
-        CHANNEL_ID,
-        "Bot started and ready to post news about major companies & markets\n"
-        "If you see this message — everything is working."
-    )
-    print("Test message sent")
-    logging.info("Test message sent")
-except Exception as e:
-    print(f"ERROR sending test message: {e}")
-    logging.error(f"Test message not sent: {e}")
+def startup_catch_up():
+    # Runs next to polling so commands are answered while the first fetch is in flight
+    announce_start()
+    print("Running initial fresh news check...")
+    logging.info("Initial fresh news check")
+    try:
+        with timed('startup_catch_up_seconds'):
+            send_recent_news(initial_run=True)
+    except Exception as e:
+        logging.error(f"Initial news check failed: {e}")
+    print("Initial check completed")
 
-threading.Thread(target=background_checker, daemon=True).start()
-threading.Thread(target=summary_scheduler, daemon=True).start()   # ← теперь работает!
 
-@bot.message_handler(commands=['summary'])
-def manual_summary(message):
-    if message.chat.type == 'private':
-        send_and_pin_summary('manual')
-        bot.reply_to(message, "Summary posted and pinned to the channel")
+def request_shutdown(signum, frame):
+    logging.info(f"Received signal {signum}, stopping")
+    shutdown_event.set()
+    bot.stop_polling()
+
+
+def run_polling():
+    # bot.polling returns when telebot gives up ("Break infinity polling") or raises;
+    # either way polling is restarted here instead of ending the process
+    try:
+        telegram_request('remove_webhook')  # getUpdates is refused while a webhook is set
+    except Exception as e:
+        logging.warning(f"Failed to remove webhook: {e}")
+    delay = POLLING_RESTART_MIN_DELAY
+    while not shutdown_event.is_set():
+        started = time.monotonic()
+        try:
+            bot.polling(non_stop=True, timeout=POLLING_TIMEOUT, long_polling_timeout=LONG_POLLING_TIMEOUT)
+        except Exception as e:
+            logging.error(f"Polling crashed: {e}")
+        if shutdown_event.is_set():
+            break
+        if time.monotonic() - started > POLLING_RESTART_MAX_DELAY:
+            delay = POLLING_RESTART_MIN_DELAY
+        inc_counter('polling_restarts_total')
+        logging.warning(f"Polling stopped, restarting in {delay}s")
+        shutdown_event.wait(delay)
+        delay = min(delay * 2, POLLING_RESTART_MAX_DELAY)
+
+
+def main():
+    load_state()
+    load_sent_news()
+    load_daily_news()
+    load_backlog()
+
+    signal.signal(signal.SIGINT, request_shutdown)
+    signal.signal(signal.SIGTERM, request_shutdown)
+
+    telegram_thread.start()
+    start_metrics_server()
+
+    targets = ', '.join(f"{channel['name']} ({channel['chat_id']})" for channel in CHANNELS)
+    print(f"Bot started → posting to {targets}")
+    logging.info(f"Bot started → {targets}")
+
+    threading.Thread(target=startup_catch_up, daemon=True, name='startup').start()
+    threading.Thread(target=background_checker, daemon=True).start()
+    threading.Thread(target=summary_scheduler, daemon=True).start()
+    threading.Thread(target=summary_builder, daemon=True, name='summary').start()
+    threading.Thread(target=state_flusher, daemon=True, name='state').start()
+
+    if WEBHOOK_URL:
+        run_webhook()
     else:
-        bot.reply_to(message, "The /summary command works only in private messages")
+        run_polling()
+    save_state()
+    save_backlog()
+    logging.info("Bot stopped")
 
-print("Running initial fresh news check...")
-logging.info("Initial fresh news check")
-send_recent_news(initial_run=True)
-print("Initial check completed")
 
-bot.infinity_polling(
-    timeout=120,
-    long_polling_timeout=90,
-    interval=5
-)
+if __name__ == '__main__':
+    main()